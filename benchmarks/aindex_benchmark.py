@@ -0,0 +1,90 @@
+# aindex_benchmark.py
+"""Compare index_with_ids with aindex_with_ids when embedding calls are slow.
+
+The embedder returns fixed vectors after a configurable delay per call, which
+stands in for a network embedding API. Each run indexes the same number of
+new documents into a fresh namespace. Run from the repository root:
+
+    python -m benchmarks.aindex_benchmark --docs 2000 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from utils import aindex_with_ids, index_with_ids
+from utils.custom_sql_record_manager import CustomSQLRecordManager
+
+
+class SlowEmbeddings(Embeddings):
+    """Fixed-size embeddings returned after a delay per call."""
+
+    def __init__(self, latency, size=8):
+        self.latency = latency
+        self.size = size
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [[float(len(text))] * self.size for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return [[float(len(text))] * self.size for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+def make_documents(count):
+    run_id = uuid.uuid4()
+    return [Document(page_content=f"{run_id} chunk {i}", metadata={"source": f"file_{i % 20}.pdf"}) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    default_path = os.path.join(tempfile.gettempdir(), "aindex_benchmark.sqlite")
+    parser.add_argument("--url", default=f"sqlite:///{default_path}", help="Sync record manager URL")
+    parser.add_argument("--async-url", default=f"sqlite+aiosqlite:///{default_path}", help="Async record manager URL")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per embedding call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    embeddings = SlowEmbeddings(args.latency)
+
+    record_manager = CustomSQLRecordManager(f"benchmark/{uuid.uuid4()}", db_url=args.url)
+    record_manager.create_schema()
+    start = time.perf_counter()
+    index_with_ids(make_documents(args.docs), record_manager, InMemoryVectorStore(embeddings), batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"{'index_with_ids':<28} {elapsed:>8.2f}s {args.docs / elapsed:>10.1f} docs/s")
+
+    for max_concurrency in args.concurrency:
+        record_manager = CustomSQLRecordManager(f"benchmark/{uuid.uuid4()}", db_url=args.async_url, async_mode=True)
+        start = time.perf_counter()
+        asyncio.run(
+            aindex_with_ids(
+                make_documents(args.docs),
+                record_manager,
+                InMemoryVectorStore(embeddings),
+                batch_size=args.batch_size,
+                max_concurrency=max_concurrency,
+            )
+        )
+        elapsed = time.perf_counter() - start
+        label = f"aindex_with_ids window={max_concurrency}"
+        print(f"{label:<28} {elapsed:>8.2f}s {args.docs / elapsed:>10.1f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
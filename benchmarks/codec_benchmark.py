@@ -0,0 +1,83 @@
+# codec_benchmark.py
+"""Compare stored size and encode/decode time of docstore value codecs.
+
+The baseline is the previous PostgresByteStore serializer (key-sorted
+OrderedDicts, pickled). Codecs that need a missing optional package are
+skipped. Run from the repository root:
+
+    python -m benchmarks.codec_benchmark --docs 2000
+"""
+import argparse
+import pickle
+import random
+import time
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+from utils.serializers import Codec
+
+WORDS = "the city council approved a new transit plan for downtown neighbourhoods and parks budget".split()
+
+
+def recursive_ordered_dict(obj):
+    """Convert nested dictionaries to key-sorted OrderedDicts."""
+    if isinstance(obj, dict):
+        return OrderedDict((k, recursive_ordered_dict(v)) for k, v in sorted(obj.items()))
+    elif isinstance(obj, list):
+        return [recursive_ordered_dict(v) for v in obj]
+    else:
+        return obj
+
+
+class PickleCodec:
+    """The previous serializer: key-sorted OrderedDicts, pickled, without header."""
+
+    def encode(self, value):
+        return pickle.dumps(recursive_ordered_dict(value))
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+def make_documents(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        Document(
+            page_content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 600))),
+            metadata={"source": f"data/file_{i % 50}.pdf", "page": i, "doc_id": f"{i:08d}-doc"},
+        )
+        for i in range(count)
+    ]
+
+
+def codecs():
+    yield "pickle (previous)", PickleCodec()
+    for format in ("pickle", "json", "msgpack"):
+        for compression in (None, "zlib", "zstd"):
+            try:
+                yield f"{format}+{compression or 'raw'}", Codec(format=format, compression=compression)
+            except ImportError as e:
+                print(f"skipping {format}+{compression}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    args = parser.parse_args()
+
+    docs = make_documents(args.docs)
+    print(f"{'codec':<20} {'bytes':>12} {'encode':>10} {'decode':>10}")
+    for label, codec in codecs():
+        start = time.perf_counter()
+        encoded = [codec.encode(doc) for doc in docs]
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = [codec.decode(data) for data in encoded]
+        decode_time = time.perf_counter() - start
+        assert [d.page_content for d in decoded] == [d.page_content for d in docs]
+        print(f"{label:<20} {sum(map(len, encoded)):>12} {encode_time:>9.3f}s {decode_time:>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
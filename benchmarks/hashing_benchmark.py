@@ -0,0 +1,83 @@
+# hashing_benchmark.py
+"""Measure documents hashed per second by the hashed document types and the process pool.
+
+Each run hashes the documents, deduplicates them and converts them back to
+Documents, as index_with_ids does per batch. "_HashedDocument + DEBUG log"
+reproduces the previous default, where importing utils configured DEBUG
+logging to hashed_document_debug.log (written to a temporary file here).
+The "hash_documents" rows hash on a pool of --workers processes, which
+index_with_ids uses when hash_workers is set. Run from the repository root:
+
+    python -m benchmarks.hashing_benchmark --docs 20000 --workers 1 2 4
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+from langchain_core.documents import Document
+
+from utils import _HashedDocument, _HashedRecord, _deduplicate_in_order
+from utils.parallel import hash_documents
+
+WORDS = "the city council approved a new transit plan for downtown neighbourhoods and parks budget".split()
+
+
+def make_documents(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        Document(
+            page_content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))),
+            metadata={"source": f"data/file_{i % 50}.pdf", "page": i},
+        )
+        for i in range(count)
+    ]
+
+
+def run(cls, docs, hash_algorithm):
+    start = time.perf_counter()
+    hashed = list(_deduplicate_in_order(cls.from_document(doc, hash_algorithm=hash_algorithm) for doc in docs))
+    [doc.to_document() for doc in hashed]
+    return time.perf_counter() - start, [doc.uid for doc in hashed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--hash-algorithm", default="sha1")
+    parser.add_argument("--workers", type=int, nargs="*", default=[], help="Process pool sizes to measure")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    docs = make_documents(args.docs)
+    utils_logger = logging.getLogger("utils.utils")
+    log_path = os.path.join(tempfile.gettempdir(), "hashed_document_debug.log")
+    handler = logging.FileHandler(log_path, mode="w")
+
+    utils_logger.addHandler(handler)
+    utils_logger.setLevel(logging.DEBUG)
+    elapsed, expected = run(_HashedDocument, docs, args.hash_algorithm)
+    utils_logger.removeHandler(handler)
+    utils_logger.setLevel(logging.NOTSET)
+    handler.close()
+    os.remove(log_path)
+    print(f"{'_HashedDocument + DEBUG log':<28} {args.docs / elapsed:>12.0f} docs/s")
+
+    for label, cls in (("_HashedDocument", _HashedDocument), ("_HashedRecord", _HashedRecord)):
+        elapsed, uids = run(cls, docs, args.hash_algorithm)
+        assert uids == expected
+        print(f"{label:<28} {args.docs / elapsed:>12.0f} docs/s")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        hashes = list(hash_documents(docs, hash_algorithm=args.hash_algorithm, chunk_size=args.chunk_size, max_workers=workers))
+        elapsed = time.perf_counter() - start
+        assert list(dict.fromkeys(uid for uid, _, _ in hashes)) == expected
+        label = f"hash_documents workers={workers}"
+        print(f"{label:<28} {args.docs / elapsed:>12.0f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
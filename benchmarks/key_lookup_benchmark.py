@@ -0,0 +1,58 @@
+# key_lookup_benchmark.py
+"""Compare the key list strategies of CustomSQLRecordManager.exists / delete_keys.
+
+For each key count, half of the keys are present in the namespace. exists()
+is timed with one IN (...) list (the previous behaviour), with a single
+= ANY(:keys) array and with a COPY into a temporary table. delete_keys() is
+then timed with the strategy chosen automatically. Requires PostgreSQL with
+the psycopg driver. Run from the repository root:
+
+    python -m benchmarks.key_lookup_benchmark --counts 10 1000 100000 1000000
+"""
+import argparse
+import time
+import uuid
+
+from utils import _batch
+from utils.custom_sql_record_manager import CustomSQLRecordManager
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except Exception as e:  # e.g. too many bind parameters for one IN list
+        return f"error: {type(e).__name__}"
+    return f"{time.perf_counter() - start:.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Database URL, defaults to database.CONNECTION_STRING")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1_000, 10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    if args.url is None:
+        from database import CONNECTION_STRING
+        args.url = CONNECTION_STRING
+
+    print(f"{'keys':>9} {'in':>14} {'array':>14} {'temp_table':>14} {'delete (auto)':>14}")
+    for count in args.counts:
+        record_manager = CustomSQLRecordManager(f"benchmark/{uuid.uuid4()}", db_url=args.url)
+        record_manager.create_schema()
+        keys = [str(uuid.uuid4()) for _ in range(count)]
+        for batch in _batch(10_000, keys[::2]):
+            record_manager.update(batch)
+
+        timings = []
+        for strategy in ("in", "array", "temp_table"):
+            record_manager._key_strategy = lambda _, strategy=strategy: strategy
+            record_manager.in_chunk_size = max(count, 1)
+            timings.append(timed(record_manager.exists, keys))
+        del record_manager._key_strategy
+        timings.append(timed(record_manager.delete_keys, keys))
+        print(f"{count:>9} " + " ".join(f"{timing:>14}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
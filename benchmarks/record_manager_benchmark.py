@@ -0,0 +1,59 @@
+# record_manager_benchmark.py
+"""Measure CustomSQLRecordManager latency per indexing batch on each backend.
+
+Each batch runs what index_with_ids does for new documents: get_time, exists
+and update. By default an embedded SQLite database is compared with the
+PostgreSQL server from database.py; pass --urls to choose the backends.
+Run from the repository root:
+
+    python -m benchmarks.record_manager_benchmark --keys 20000 --batch-size 100
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+from utils.custom_sql_record_manager import CustomSQLRecordManager
+
+
+def run(url, keys, batch_size):
+    namespace = f"benchmark/{uuid.uuid4()}"
+    record_manager = CustomSQLRecordManager(namespace, db_url=url)
+    record_manager.create_schema()
+    latencies = []
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        begin = time.perf_counter()
+        index_start = record_manager.get_time()
+        record_manager.exists(batch)
+        record_manager.update(batch, group_ids=["benchmark"] * len(batch), time_at_least=index_start)
+        latencies.append(time.perf_counter() - begin)
+    record_manager.delete_keys(keys)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", nargs="+", default=None, help="Database URLs, defaults to SQLite and database.CONNECTION_STRING")
+    parser.add_argument("--keys", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    urls = args.urls
+    if urls is None:
+        from database import CONNECTION_STRING
+        urls = [f"sqlite:///{os.path.join(tempfile.gettempdir(), 'record_manager_benchmark.sqlite')}", CONNECTION_STRING]
+
+    keys = [str(uuid.uuid4()) for _ in range(args.keys)]
+    print(f"{'backend':<12} {'batches':>8} {'mean ms':>10} {'p95 ms':>10} {'total s':>10}")
+    for url in urls:
+        latencies = run(url, keys, args.batch_size)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        backend = url.split(":", 1)[0]
+        print(f"{backend:<12} {len(latencies):>8} {statistics.mean(latencies) * 1000:>10.2f} {p95 * 1000:>10.2f} {sum(latencies):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# store_mset_benchmark.py
+"""Compare the per-item merge() write path with the bulk upsert path of PostgresByteStore.mset.
+
+Counts the statements sent to the database (round trips) and the wall time
+for each chunk size. Run from the repository root:
+
+    python -m benchmarks.store_mset_benchmark --items 5000
+"""
+import argparse
+import time
+
+from sqlalchemy import delete, event
+from langchain_core.documents import Document
+
+from utils.store import ByteStore, PostgresByteStore
+
+
+def make_items(count, filename="benchmark.pdf"):
+    return [
+        (f"bench-{i}", Document(page_content=f"Parent page {i} " * 40, metadata={"source": filename, "page": i}), filename)
+        for i in range(count)
+    ]
+
+
+def merge_mset(store, items):
+    """The previous mset implementation: one session.merge() per item."""
+    with store.Session() as session:
+        for key, value, filename in items:
+            session.merge(ByteStore(**store.build_row(key, value, filename)))
+        session.commit()
+
+
+class StatementCounter:
+    """Counts the statements an engine sends to the database while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def clear(store):
+    with store.Session() as session:
+        session.execute(delete(ByteStore).where(ByteStore.collection_name == store.collection_name))
+        session.commit()
+
+
+def run(store, items, label, write):
+    clear(store)
+    with StatementCounter(store.engine) as counter:
+        start = time.perf_counter()
+        write(items)
+        elapsed = time.perf_counter() - start
+    print(f"{label:<24} {len(items):>8} items {counter.statements:>8} statements {elapsed:>9.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Database URL, defaults to database.CONNECTION_STRING")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1, 10, 100, 500, 1000])
+    args = parser.parse_args()
+
+    if args.url is None:
+        from database import CONNECTION_STRING
+        args.url = CONNECTION_STRING
+
+    store = PostgresByteStore(args.url, "mset_benchmark")
+    items = make_items(args.items)
+
+    run(store, items, "merge (previous)", lambda batch: merge_mset(store, batch))
+    for chunk_size in args.chunk_sizes:
+        run(store, items, f"upsert chunk={chunk_size}", lambda batch: store.mset(batch, chunk_size=chunk_size))
+    clear(store)
+
+
+if __name__ == "__main__":
+    main()
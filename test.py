@@ -1,9 +1,10 @@
-from sqlalchemy import create_engine, MetaData, Table, select, update, String, TypeDecorator
+from sqlalchemy import MetaData, Table, select, update, String, TypeDecorator
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.types import BINARY, JSON
 import json
 import os
 from dotenv import load_dotenv
+from utils.engines import get_engine
 
 # Define a custom type for 'vector'
 class VectorType(TypeDecorator):
@@ -24,7 +25,7 @@ COLLECTION_NAME = os.getenv("PGDATABASE")
 CONNECTION_STRING = f"postgresql+psycopg://{user}:{password}@{host}:5432/{COLLECTION_NAME}"
 
 # Create the engine and session
-engine = create_engine(CONNECTION_STRING)
+engine = get_engine(CONNECTION_STRING)
 Session = sessionmaker(bind=engine)
 
 # Define tables
@@ -0,0 +1,32 @@
+from utils.cache import LRUCache
+from utils.store import PostgresByteStore
+
+
+def test_put_many_skips_keys_invalidated_since_the_generation():
+    cache = LRUCache(max_size=2)
+    generation = cache.generation()
+    cache.invalidate(["a"])
+    cache.put_many({"a": "stale", "b": "fresh"}, generation)
+    assert cache.get_many(["a", "b"]) == ({"b": "fresh"}, ["a"])
+
+    # Once "a" is forgotten, fills from before its invalidation are skipped whole
+    cache.invalidate(["c", "d"])
+    cache.put_many({"a": "stale", "e": "fresh"}, generation)
+    assert cache.get_many(["a", "e"]) == ({}, ["a", "e"])
+    cache.put_many({"a": "fresh"}, cache.generation())
+    assert cache.get_many(["a"]) == ({"a": "fresh"}, [])
+
+
+def test_mget_does_not_cache_a_value_overwritten_during_the_query(tmp_path, monkeypatch):
+    store = PostgresByteStore(f"sqlite:///{tmp_path / 'store.db'}", "test", cache=LRUCache())
+    store.mset([("k", "old", "file.txt")])
+    deserialize = store.deserialize_value
+
+    # A write committed by another client while the rows are being read
+    def deserialize_during_write(value):
+        store.invalidate_cache(["k"])
+        return deserialize(value)
+
+    monkeypatch.setattr(store, "deserialize_value", deserialize_during_write)
+    assert store.mget(["k"]) == ["old"]
+    assert store.cache.get_many(["k"]) == ({}, ["k"])
@@ -0,0 +1,46 @@
+import re
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from utils import EmbeddingCache
+from utils.store import PostgresByteStore
+
+# Keys accepted by langchain's LocalFileStore
+LOCAL_FILE_STORE_KEY = re.compile(r"^[a-zA-Z0-9_.\-/]+$")
+
+
+class _LengthEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(text)), 0.1] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def _embed_twice(store):
+    """Embed the same texts with two caches sharing store; return the second result."""
+    embeddings = _LengthEmbeddings()
+    texts, hashes = ["a", "bb"], ["hash-a", "hash-b"]
+    EmbeddingCache(embeddings, "ollama:nomic-embed-text", store=store).embed_documents(texts, hashes)
+    result = EmbeddingCache(embeddings, "ollama:nomic-embed-text", store=store).embed_documents(texts, hashes)
+    assert embeddings.calls == 1
+    return result
+
+
+def test_vectors_round_trip_through_a_local_file_store(tmp_path):
+    storage = pytest.importorskip("langchain.storage")
+    store = storage.LocalFileStore(tmp_path)
+    assert _embed_twice(store) == ([[1.0, 0.1], [2.0, 0.1]], 2, 0)
+
+
+def test_keys_are_path_safe_and_round_trip_through_a_file_backed_store(tmp_path):
+    store = PostgresByteStore(f"sqlite:///{tmp_path / 'store.db'}", "embeddings")
+    assert _embed_twice(store) == ([[1.0, 0.1], [2.0, 0.1]], 2, 0)
+    keys = list(store.yield_keys())
+    assert len(keys) == 2
+    assert all(LOCAL_FILE_STORE_KEY.match(key) for key in keys)
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from utils import CustomSQLRecordManager, aindex_with_ids, aiter_index_with_ids, index_with_ids, iter_index_with_ids
+
+
+class _LengthEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        # Yield to the event loop so concurrent batches overlap
+        await asyncio.sleep(0.01)
+        return self.embed_documents(texts)
+
+
+def _docs(*contents):
+    return [Document(page_content=content, metadata={"source": "doc.txt"}) for content in contents]
+
+
+def _stored_keys(record_manager, vector_store):
+    return set(record_manager.list_keys()), set(vector_store.store)
+
+
+@pytest.fixture
+def record_manager(tmp_path):
+    record_manager = CustomSQLRecordManager("test", db_url=f"sqlite:///{tmp_path / 'records.db'}")
+    record_manager.create_schema()
+    return record_manager
+
+
+@pytest.fixture
+def vector_store():
+    return InMemoryVectorStore(_LengthEmbeddings())
+
+
+@pytest.mark.parametrize("cleanup", ["full", "incremental"])
+def test_stopping_at_a_cleanup_record_keeps_records_and_vectors_in_sync(record_manager, vector_store, cleanup):
+    for _ in iter_index_with_ids(_docs("a", "b", "c", "d"), record_manager, vector_store, source_id_key="source"):
+        pass
+
+    records = iter_index_with_ids(
+        _docs("e"), record_manager, vector_store, cleanup=cleanup, source_id_key="source", cleanup_batch_size=1
+    )
+    for record in records:
+        if record["num_deleted"]:
+            break
+    records.close()
+
+    keys, vectors = _stored_keys(record_manager, vector_store)
+    assert keys == vectors
+    assert len(keys) == 4
+
+    # The next run finishes the cleanup and leaves only the new document
+    result = list(iter_index_with_ids(_docs("e"), record_manager, vector_store, cleanup=cleanup, source_id_key="source"))
+    keys, vectors = _stored_keys(record_manager, vector_store)
+    assert keys == vectors
+    assert len(keys) == 1
+    assert sum(record["num_skipped"] for record in result) == 1
+
+
+def test_async_stopping_at_a_cleanup_record_keeps_records_and_vectors_in_sync(tmp_path, vector_store):
+    async def run():
+        record_manager = CustomSQLRecordManager(
+            "test", db_url=f"sqlite+aiosqlite:///{tmp_path / 'records.db'}", async_mode=True
+        )
+        await record_manager.acreate_schema()
+        async for _ in aiter_index_with_ids(_docs("a", "b", "c", "d"), record_manager, vector_store):
+            pass
+
+        records = aiter_index_with_ids(_docs("e"), record_manager, vector_store, cleanup="full", cleanup_batch_size=1)
+        async for record in records:
+            if record["num_deleted"]:
+                break
+        await records.aclose()
+        return set(await record_manager.alist_keys())
+
+    keys = asyncio.run(run())
+    assert keys == set(vector_store.store)
+    assert len(keys) == 4
+
+
+def test_failed_vector_delete_keeps_the_records(record_manager, vector_store, monkeypatch):
+    for _ in iter_index_with_ids(_docs("a", "b", "c"), record_manager, vector_store):
+        pass
+
+    def failing_delete(ids=None, **kwargs):
+        raise RuntimeError("vector store unavailable")
+
+    monkeypatch.setattr(vector_store, "delete", failing_delete)
+    with pytest.raises(RuntimeError):
+        for _ in iter_index_with_ids(_docs("d"), record_manager, vector_store, cleanup="full"):
+            pass
+
+    keys, vectors = _stored_keys(record_manager, vector_store)
+    assert keys == vectors
+    assert len(keys) == 4
+
+
+def test_run_dedup_drops_repeats_of_earlier_batches_only_within_a_run(record_manager, vector_store):
+    docs = _docs("a", "b", "a", "c", "b")
+    for _ in range(2):
+        records = list(
+            iter_index_with_ids(docs, record_manager, vector_store, batch_size=2, cleanup="full", run_dedup=True)
+        )
+        assert sum(record["num_repeated"] for record in records) == 2
+        assert sum(record["num_deleted"] for record in records) == 0
+
+    keys, vectors = _stored_keys(record_manager, vector_store)
+    assert keys == vectors
+    assert len(keys) == 3
+
+
+def test_async_reports_repeats_of_batches_in_flight_like_sync(tmp_path, record_manager, vector_store):
+    docs = _docs("a", "b", "a", "c")
+    expected = index_with_ids(docs, record_manager, vector_store, batch_size=2)
+
+    async def run(async_vector_store):
+        async_record_manager = CustomSQLRecordManager(
+            "test", db_url=f"sqlite+aiosqlite:///{tmp_path / 'async_records.db'}", async_mode=True
+        )
+        await async_record_manager.acreate_schema()
+        result = await aindex_with_ids(docs, async_record_manager, async_vector_store, batch_size=2)
+        return result, set(await async_record_manager.alist_keys())
+
+    async_vector_store = InMemoryVectorStore(_LengthEmbeddings())
+    result, keys = asyncio.run(run(async_vector_store))
+    assert result["results"] == expected["results"]
+    assert (expected["results"][0]["num_added"], expected["results"][0]["num_skipped"]) == (3, 1)
+    assert sorted(op["operation"] for op in result["ids"]) == sorted(op["operation"] for op in expected["ids"])
+    assert keys == set(async_vector_store.store) == set(vector_store.store)
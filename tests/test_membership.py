@@ -0,0 +1,24 @@
+import os
+
+from utils.membership import DigestSet, RunDeduplicator
+
+
+def test_digest_set_keeps_every_digest_when_growing():
+    digests = [os.urandom(16) for _ in range(5_000)] + [bytes(16)]
+    digest_set = DigestSet(capacity=4)
+    assert all(digest_set.add(digest) for digest in digests)
+    assert not any(digest_set.add(digest) for digest in digests)
+    assert len(digest_set) == len(digests)
+    assert sorted(digest_set) == sorted(digests)
+    assert os.urandom(16) not in digest_set
+
+
+def test_run_deduplicator_freezes_within_its_memory_cap():
+    deduplicator = RunDeduplicator(max_bytes=4_096)
+    keys = [f"key-{i}" for i in range(1_000)]
+    assert all(deduplicator.add(key) for key in keys)
+    assert deduplicator.frozen
+    assert deduplicator.memory_bytes <= 4_096
+    # Recorded keys are still repeats; keys past the cap are never reported as repeats
+    assert not deduplicator.add(keys[0])
+    assert deduplicator.add(keys[-1])
@@ -1,4 +1,7 @@
 # utils/__init__.py
-from .utils import _HashedDocument, _deduplicate_in_order, _batch, _get_source_id_assigner
+from .utils import _HashedDocument, _HashedRecord, _deduplicate_in_order, _batch, _get_source_id_assigner
 from .custom_sql_record_manager import CustomSQLRecordManager
-from .index_with_ids import index_with_ids
+from .batching import AdaptiveBatcher
+from .membership import RunDeduplicator
+from .embedding_cache import EmbeddingCache
+from .index_with_ids import index_with_ids, aindex_with_ids, iter_index_with_ids, aiter_index_with_ids
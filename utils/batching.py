@@ -0,0 +1,140 @@
+# batching.py
+import math
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+
+class AdaptiveBatcher:
+    """Packs texts into embedding calls by estimated token count.
+
+    Child chunks, parent summaries and hypothetical questions differ a lot in
+    length, so a fixed number of documents per call is either far below the
+    provider's limits or above them. Each call gets up to token_budget
+    estimated tokens (and at most max_batch_size texts); a text larger than
+    the budget is sent on its own.
+
+    The budget follows the feedback reported for each call:
+
+    - a failure multiplies it by backoff, and the failed texts are retried in
+      smaller calls (see index_with_ids);
+    - a success slower than target_latency shrinks it in proportion;
+    - any other success multiplies it by growth, up to max_token_budget.
+
+    Without target_latency the budget grows until the provider rejects a call,
+    then settles just below that size.
+
+    Args:
+        token_budget: Initial estimated tokens per call.
+        min_token_budget: Lower bound of the budget.
+        max_token_budget: Upper bound of the budget, e.g. the provider's
+            per-request token limit.
+        max_batch_size: Maximum number of texts per call.
+        target_latency: Seconds a call should take at most, or None.
+        growth: Factor applied to the budget after a fast success.
+        backoff: Factor applied to the budget after a failure.
+        chars_per_token: Characters per token used by the default estimate.
+        token_counter: Optional function returning the token count of a text,
+            e.g. built on the model's tokenizer. Replaces the estimate.
+        retry_on: Exception types treated as feedback and retried. Others are
+            raised immediately.
+        max_retries: Retries of the same texts before the error is raised.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 8_000,
+        *,
+        min_token_budget: int = 500,
+        max_token_budget: int = 100_000,
+        max_batch_size: int = 2_048,
+        target_latency: Optional[float] = None,
+        growth: float = 1.25,
+        backoff: float = 0.5,
+        chars_per_token: float = 4.0,
+        token_counter: Optional[Callable[[str], int]] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        max_retries: int = 3,
+    ) -> None:
+        if not 0 < min_token_budget <= token_budget <= max_token_budget:
+            raise ValueError(
+                "Expected 0 < min_token_budget <= token_budget <= max_token_budget. "
+                f"Got {min_token_budget}, {token_budget} and {max_token_budget}."
+            )
+        if growth < 1 or not 0 < backoff < 1:
+            raise ValueError(f"growth should be at least 1 and backoff between 0 and 1. Got {growth} and {backoff}.")
+        self.token_budget = token_budget
+        self.min_token_budget = min_token_budget
+        self.max_token_budget = max_token_budget
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.growth = growth
+        self.backoff = backoff
+        self.chars_per_token = chars_per_token
+        self.token_counter = token_counter
+        self.retry_on = retry_on
+        self.max_retries = max_retries
+        self.calls = 0
+        self.failures = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def estimate_tokens(self, text: str) -> int:
+        if self.token_counter is not None:
+            return self.token_counter(text)
+        return max(1, math.ceil(len(text) / self.chars_per_token))
+
+    def batches(self, items: Sequence[T], texts: Sequence[str]) -> Iterator[Tuple[List[T], int]]:
+        """Split items into calls by the estimated tokens of their texts.
+
+        Yields each call's items with its estimated token count. The budget
+        is read when a call starts, so feedback from earlier calls applies to
+        the next one.
+        """
+        batch: List[T] = []
+        batch_tokens = 0
+        for item, text in zip(items, texts):
+            tokens = self.estimate_tokens(text)
+            if batch and (batch_tokens + tokens > self.token_budget or len(batch) >= self.max_batch_size):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def record_success(self, tokens: int, latency: float) -> None:
+        """Report a call of tokens estimated tokens that took latency seconds."""
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.seconds += latency
+            if self.target_latency is not None and latency > self.target_latency:
+                budget = self.token_budget * max(self.backoff, self.target_latency / latency)
+            elif tokens * self.growth >= self.token_budget:
+                # Only grow when the call actually used most of the budget
+                budget = self.token_budget * self.growth
+            else:
+                return
+            self.token_budget = int(min(self.max_token_budget, max(self.min_token_budget, budget)))
+
+    def record_failure(self, error: BaseException) -> bool:
+        """Report a failed call; return whether it should be retried."""
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self.token_budget = int(max(self.min_token_budget, self.token_budget * self.backoff))
+        return isinstance(error, self.retry_on)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current budget and call counters."""
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "calls": self.calls,
+                "failures": self.failures,
+                "tokens": self.tokens,
+                "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+            }
@@ -0,0 +1,115 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class LRUCache:
+    """A thread-safe, size-bounded LRU cache with optional time-to-live.
+
+    Used by PostgresByteStore to serve repeated docstore reads from memory.
+    Values are stored as returned by the store, so callers share the cached
+    objects and should not mutate them.
+
+    Every invalidation advances a generation counter. A reader takes
+    generation() before querying the database and passes it to put_many,
+    which then skips keys invalidated since, so a write that commits while
+    the query runs is not overwritten by the value read before it.
+
+    Args:
+        max_size: Maximum number of entries kept. Least recently used entries
+            are evicted first.
+        ttl: Seconds after which an entry expires. None keeps entries until
+            they are evicted or invalidated.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None) -> None:
+        if max_size <= 0:
+            raise ValueError(f"max_size should be a positive integer. Got {max_size}.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # Generation at which each recently invalidated key was dropped, capped
+        # at max_size keys; fills older than the oldest forgotten one are skipped
+        self._generation = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._forgotten_generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        """Return the current invalidation generation, to pass to put_many."""
+        with self._lock:
+            return self._generation
+
+    def get_many(self, keys: Sequence[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """Return the cached values and the keys that must be fetched."""
+        found: Dict[str, Any] = {}
+        missing: List[str] = []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    missing.append(key)
+                    self.misses += 1
+        return found, missing
+
+    def put_many(self, values: Dict[str, Any], generation: Optional[int] = None) -> None:
+        """Store values, evicting the least recently used entries if needed.
+
+        With a generation from generation(), keys invalidated after it are
+        left out, since the values may predate the write that invalidated them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation < self._forgotten_generation:
+                return
+            for key, value in values.items():
+                if generation is not None and self._invalidated.get(key, generation) > generation:
+                    continue
+                self._entries[key] = (now, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        """Drop the given keys from the cache."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._forgotten_generation = max(self._forgotten_generation, forgotten)
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,9 +1,12 @@
 # custom_sql_record_manager.py
 import contextlib
 import decimal
+import threading
+import time
 import uuid
-from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Union, Generator
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Literal, Optional, Sequence, Set, Tuple, Union, Generator
 from utils import _HashedDocument, _deduplicate_in_order, _batch, _get_source_id_assigner
+from utils.engines import get_engine, get_async_engine
 
 from sqlalchemy import (
     URL,
@@ -13,9 +16,13 @@ from sqlalchemy import (
     String,
     UniqueConstraint,
     Index,
+    PrimaryKeyConstraint,
+    inspect,
     and_,
-    create_engine,
+    any_,
+    bindparam,
     delete,
+    func,
     select,
     text,
 )
@@ -23,15 +30,20 @@ from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
     async_sessionmaker,
-    create_async_engine,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Query, Session, sessionmaker
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from langchain_core.indexing import RecordManager
+from utils.membership import BloomFilter
 
 Base = declarative_base()
 
+# Temporary table that large key lists are copied into (PostgreSQL only).
+# Rows are dropped at the end of every transaction.
+_KEYS_TEMP_TABLE = "_record_manager_keys"
+
 class UpsertionRecord(Base):  # type: ignore[valid-type,misc]
     """Table used to keep track of when a key was last updated."""
 
@@ -55,6 +67,34 @@ class UpsertionRecord(Base):  # type: ignore[valid-type,misc]
     )
 
 
+LeanBase = declarative_base()
+
+
+class LeanUpsertionRecord(LeanBase):  # type: ignore[valid-type,misc]
+    """Lean layout of the upsertion_record table.
+
+    The (namespace, key) primary key replaces the uuid key, the unique
+    constraint and the single-column indexes. The composite indexes serve the
+    cleanup queries as range scans: (namespace, group_id, updated_at) the
+    incremental one (group_id IN (...) AND updated_at < t), and
+    (namespace, updated_at) the full one (updated_at < t), which runs once
+    per cleanup chunk.
+    """
+
+    __tablename__ = "upsertion_record"
+
+    namespace = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    group_id = Column(String, nullable=True)
+    updated_at = Column(Float)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("namespace", "key", name="pk_upsertion_record_namespace_key"),
+        Index("ix_upsertion_record_namespace_group_updated", "namespace", "group_id", "updated_at"),
+        Index("ix_upsertion_record_namespace_updated", "namespace", "updated_at"),
+    )
+
+
 class CustomSQLRecordManager(RecordManager):
     """A SQL Alchemy based implementation of the record manager."""
 
@@ -66,31 +106,72 @@ class CustomSQLRecordManager(RecordManager):
         db_url: Union[None, str, URL] = None,
         engine_kwargs: Optional[Dict[str, Any]] = None,
         async_mode: bool = False,
+        clock: Literal["server", "calibrated"] = "server",
+        clock_resync_interval: float = 60.0,
+        array_threshold: int = 10_000,
+        temp_table_chunk_size: int = 100_000,
+        in_chunk_size: int = 5_000,
+        table_layout: Literal["legacy", "lean"] = "legacy",
     ) -> None:
         """Initialize the CustomSQLRecordManager.
 
         This class serves as a manager persistence layer that uses an SQL
         backend to track upserted records. You should specify either a db_url
-        to create an engine or provide an existing engine.
+        to create an engine or provide an existing engine. PostgreSQL and
+        SQLite are supported; use "sqlite:///path" or, with async_mode,
+        "sqlite+aiosqlite:///path" for an embedded database.
 
         Args:
             namespace: The namespace associated with this record manager.
             engine: An already existing SQL Alchemy engine.
                 Default is None.
             db_url: A database connection string used to create
-                an SQL Alchemy engine. Default is None.
+                an SQL Alchemy engine. Engines are shared with other components
+                using the same url and options (see utils.engines).
+                Default is None.
             engine_kwargs: Additional keyword arguments
                 to be passed when creating the engine. Default is an empty dictionary.
             async_mode: Whether to create an async engine.
                 Driver should support async operations.
                 It only applies if db_url is provided.
                 Default is False.
+            clock: How get_time obtains timestamps. "server" queries the
+                database on every call. "calibrated" measures the offset between
+                the server clock and a local monotonic clock, then derives
+                timestamps locally, which saves a round trip per update().
+                Timestamps never go backwards; they may differ from the server
+                clock by up to half the round trip of the last calibration.
+                Default is "server".
+            clock_resync_interval: Seconds after which the calibrated clock
+                measures the server offset again. Default is 60.
+            array_threshold: On PostgreSQL, exists and delete_keys send up to
+                this many keys as a single array parameter (key = ANY(:keys)).
+                Larger lists are copied into a temporary table and joined,
+                which requires the psycopg (v3) driver; with other drivers
+                they are split into arrays of array_threshold keys.
+                Default is 10,000.
+            temp_table_chunk_size: Number of keys copied into the temporary
+                table per transaction. Default is 100,000.
+            in_chunk_size: On other dialects, maximum number of keys per
+                IN (...) list; longer lists are split. Default is 5,000.
+            table_layout: "legacy" uses the original upsertion_record table
+                (UpsertionRecord). "lean" uses LeanUpsertionRecord, which has
+                fewer indexes to maintain on every update and serves
+                incremental cleanup with one composite index. Existing tables
+                are converted with migrate_to_lean_layout(). Default is "legacy".
 
         Raises:
-            ValueError: If both db_url and engine are provided or neither.
+            ValueError: If both db_url and engine are provided or neither,
+                if clock is not one of "server" or "calibrated", or if
+                table_layout is not one of "legacy" or "lean".
             AssertionError: If something unexpected happens during engine configuration.
         """
         super().__init__(namespace=namespace)
+        if clock not in {"server", "calibrated"}:
+            raise ValueError(f"clock should be one of 'server' or 'calibrated'. Got {clock}.")
+        if table_layout not in {"legacy", "lean"}:
+            raise ValueError(f"table_layout should be one of 'legacy' or 'lean'. Got {table_layout}.")
+
         if db_url is None and engine is None:
             raise ValueError("Must specify either db_url or engine")
 
@@ -100,9 +181,9 @@ class CustomSQLRecordManager(RecordManager):
         _engine: Union[Engine, AsyncEngine]
         if db_url:
             if async_mode:
-                _engine = create_async_engine(db_url, **(engine_kwargs or {}))
+                _engine = get_async_engine(db_url, **(engine_kwargs or {}))
             else:
-                _engine = create_engine(db_url, **(engine_kwargs or {}))
+                _engine = get_engine(db_url, **(engine_kwargs or {}))
         elif engine:
             _engine = engine
 
@@ -118,13 +199,34 @@ class CustomSQLRecordManager(RecordManager):
         self.engine = _engine
         self.dialect = _engine.dialect.name
         self.session_factory = _session_factory
+        self.clock = clock
+        self.table_layout = table_layout
+        self.record_model = LeanUpsertionRecord if table_layout == "lean" else UpsertionRecord
+        self.array_threshold = array_threshold
+        self.temp_table_chunk_size = temp_table_chunk_size
+        self.in_chunk_size = in_chunk_size
+        # Optional filter answering "definitely absent" locally, see warm_membership_filter
+        self.membership_filter: Optional[BloomFilter] = None
+        self.clock_resync_interval = clock_resync_interval
+        # Server time and local monotonic time of the last calibration
+        self._clock_anchor: Optional[Tuple[float, float]] = None
+        self._last_time = 0.0
+        self._clock_lock = threading.Lock()
+
+    def _create_tables(self, connection: Any) -> None:
+        """Create the table, and the indexes added to an existing lean table since it was created."""
+        self.record_model.metadata.create_all(connection)
+        if self.table_layout == "lean":
+            for index in LeanUpsertionRecord.__table__.indexes:
+                index.create(connection, checkfirst=True)
 
     def create_schema(self) -> None:
         """Create the database schema."""
         if isinstance(self.engine, AsyncEngine):
             raise AssertionError("This method is not supported for async engines.")
 
-        Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            self._create_tables(connection)
 
     async def acreate_schema(self) -> None:
         """Create the database schema."""
@@ -133,7 +235,48 @@ class CustomSQLRecordManager(RecordManager):
             raise AssertionError("This method is not supported for sync engines.")
 
         async with self.engine.begin() as session:
-            await session.run_sync(Base.metadata.create_all)
+            await session.run_sync(self._create_tables)
+
+    def migrate_to_lean_layout(self) -> bool:
+        """Convert an existing legacy upsertion_record table to the lean layout.
+
+        The table is rebuilt in a single transaction: the legacy table is
+        renamed, the lean table and its indexes are created, rows are copied
+        and the legacy table (with its indexes) is dropped. Rows without a key
+        are not copied. The table is shared by every namespace, so all record
+        managers using it must switch to table_layout="lean" afterwards.
+        A table that already has the lean layout gets the indexes it lacks.
+
+        Returns:
+            True if the table was migrated, False if it already had the lean
+            layout or did not exist.
+        """
+        if isinstance(self.engine, AsyncEngine):
+            raise AssertionError("This method is not supported for async engines.")
+
+        table = UpsertionRecord.__tablename__
+        legacy_table = f"{table}_legacy"
+        inspector = inspect(self.engine)
+        if not inspector.has_table(table):
+            return False
+        if "uuid" not in {column["name"] for column in inspector.get_columns(table)}:
+            with self.engine.begin() as connection:
+                for index in LeanUpsertionRecord.__table__.indexes:
+                    index.create(connection, checkfirst=True)
+            return False
+
+        with self.engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy_table}"))
+            LeanBase.metadata.create_all(connection)
+            connection.execute(
+                text(
+                    f"INSERT INTO {table} (namespace, key, group_id, updated_at) "
+                    f"SELECT namespace, key, group_id, updated_at FROM {legacy_table} "
+                    f"WHERE key IS NOT NULL"
+                )
+            )
+            connection.execute(text(f"DROP TABLE {legacy_table}"))
+        return True
 
     @contextlib.contextmanager
     def _make_session(self) -> Generator[Session, None, None]:
@@ -158,12 +301,8 @@ class CustomSQLRecordManager(RecordManager):
         async with self.session_factory() as session:
             yield session
 
-    def get_time(self) -> float:
-        """Get the current server time as a timestamp.
-
-        Please note it's critical that time is obtained from the server since
-        we want a monotonic clock.
-        """
+    def _get_server_time(self) -> float:
+        """Query the current server time as a timestamp."""
         with self._make_session() as session:
             if self.dialect == "sqlite":
                 query = text("SELECT (julianday('now') - 2440587.5) * 86400.0;")
@@ -179,12 +318,8 @@ class CustomSQLRecordManager(RecordManager):
                 raise AssertionError(f"Unexpected type for datetime: {type(dt)}")
             return dt
 
-    async def aget_time(self) -> float:
-        """Get the current server time as a timestamp.
-
-        Please note it's critical that time is obtained from the server since
-        we want a monotonic clock.
-        """
+    async def _aget_server_time(self) -> float:
+        """Query the current server time as a timestamp."""
         async with self._amake_session() as session:
             if self.dialect == "sqlite":
                 query = text("SELECT (julianday('now') - 2440587.5) * 86400.0;")
@@ -201,6 +336,71 @@ class CustomSQLRecordManager(RecordManager):
                 raise AssertionError(f"Unexpected type for datetime: {type(dt)}")
             return dt
 
+    def _needs_calibration(self) -> bool:
+        """Whether the calibrated clock must measure the server offset again."""
+        return (
+            self._clock_anchor is None
+            or time.monotonic() - self._clock_anchor[1] >= self.clock_resync_interval
+        )
+
+    def _calibrate(self, server_time: float, sent: float, received: float) -> None:
+        """Anchor the local clock to a server timestamp taken mid round trip."""
+        with self._clock_lock:
+            self._clock_anchor = (server_time, (sent + received) / 2)
+
+    def _local_time(self) -> float:
+        """Derive a server timestamp from the monotonic clock, never going backwards."""
+        with self._clock_lock:
+            server_time, anchor = self._clock_anchor
+            self._last_time = max(self._last_time, server_time + time.monotonic() - anchor)
+            return self._last_time
+
+    def get_time(self) -> float:
+        """Get the current server time as a timestamp.
+
+        Please note it's critical that time is obtained from the server since
+        we want a monotonic clock. With the calibrated clock the server is only
+        queried every clock_resync_interval seconds.
+        """
+        if self.clock == "server":
+            return self._get_server_time()
+        if self._needs_calibration():
+            sent = time.monotonic()
+            server_time = self._get_server_time()
+            self._calibrate(server_time, sent, time.monotonic())
+        return self._local_time()
+
+    async def aget_time(self) -> float:
+        """Get the current server time as a timestamp.
+
+        Please note it's critical that time is obtained from the server since
+        we want a monotonic clock. With the calibrated clock the server is only
+        queried every clock_resync_interval seconds.
+        """
+        if self.clock == "server":
+            return await self._aget_server_time()
+        if self._needs_calibration():
+            sent = time.monotonic()
+            server_time = await self._aget_server_time()
+            self._calibrate(server_time, sent, time.monotonic())
+        return self._local_time()
+
+    def _upsert_statement(self, records: List[Dict[str, Any]]) -> Any:
+        """Build an INSERT ... ON CONFLICT DO UPDATE for the engine's dialect."""
+        if self.dialect == "postgresql":
+            insert_stmt = pg_insert(self.record_model).values(records)
+        elif self.dialect == "sqlite":
+            insert_stmt = sqlite_insert(self.record_model).values(records)
+        else:
+            raise NotImplementedError(f"Not implemented for dialect {self.dialect}")
+        return insert_stmt.on_conflict_do_update(
+            index_elements=[self.record_model.key, self.record_model.namespace],
+            set_={
+                "updated_at": insert_stmt.excluded.updated_at,
+                "group_id": insert_stmt.excluded.group_id,
+            },
+        )
+
     def update(
         self,
         keys: Sequence[str],
@@ -208,7 +408,7 @@ class CustomSQLRecordManager(RecordManager):
         group_ids: Optional[Sequence[Optional[str]]] = None,
         time_at_least: Optional[float] = None,
     ) -> None:
-        """Upsert records into the PostgreSQL database."""
+        """Upsert records into the database."""
         if group_ids is None:
             group_ids = [None] * len(keys)
 
@@ -234,18 +434,10 @@ class CustomSQLRecordManager(RecordManager):
         ]
 
         with self._make_session() as session:
-            pg_insert_stmt = pg_insert(UpsertionRecord).values(
-                records_to_upsert
-            )
-            stmt = pg_insert_stmt.on_conflict_do_update(
-                constraint="uix_key_namespace",
-                set_={
-                    "updated_at": pg_insert_stmt.excluded.updated_at,
-                    "group_id": pg_insert_stmt.excluded.group_id,
-                },
-            )
-            session.execute(stmt)
+            session.execute(self._upsert_statement(records_to_upsert))
             session.commit()
+        if self.membership_filter is not None:
+            self.membership_filter.update(keys)
 
     async def aupdate(
         self,
@@ -254,7 +446,7 @@ class CustomSQLRecordManager(RecordManager):
         group_ids: Optional[Sequence[Optional[str]]] = None,
         time_at_least: Optional[float] = None,
     ) -> None:
-        """Upsert records into the PostgreSQL database."""
+        """Upsert records into the database."""
         if group_ids is None:
             group_ids = [None] * len(keys)
 
@@ -280,52 +472,209 @@ class CustomSQLRecordManager(RecordManager):
         ]
 
         async with self._amake_session() as session:
-            pg_insert_stmt = pg_insert(UpsertionRecord).values(
-                records_to_upsert
-            )
-            stmt = pg_insert_stmt.on_conflict_do_update(
-                constraint="uix_key_namespace",
-                set_={
-                    "updated_at": pg_insert_stmt.excluded.updated_at,
-                    "group_id": pg_insert_stmt.excluded.group_id,
-                },
-            )
-            await session.execute(stmt)
+            await session.execute(self._upsert_statement(records_to_upsert))
             await session.commit()
+        if self.membership_filter is not None:
+            self.membership_filter.update(keys)
+
+    def _key_strategy(self, count: int) -> Literal["in", "array", "temp_table"]:
+        """Choose how a list of count keys is sent to the database."""
+        if self.dialect != "postgresql":
+            return "in"
+        if count <= self.array_threshold or self.engine.dialect.driver != "psycopg":
+            return "array"
+        return "temp_table"
+
+    def _key_chunks(self, keys: Sequence[str], strategy: str) -> List[List[str]]:
+        """Split keys into the chunks sent per statement for a strategy."""
+        if strategy == "in":
+            return list(_batch(self.in_chunk_size, keys))
+        if strategy == "temp_table":
+            return list(_batch(self.temp_table_chunk_size, keys))
+        return list(_batch(self.array_threshold, keys))
+
+    def _key_filter(self, keys: List[str], strategy: str) -> Any:
+        """Filter on the namespace and a chunk of keys."""
+        if strategy == "array":
+            key_filter = self.record_model.key == any_(bindparam("keys", keys, type_=ARRAY(String)))
+        else:
+            key_filter = self.record_model.key.in_(keys)
+        return and_(key_filter, self.record_model.namespace == self.namespace)
+
+    def _temp_table_statements(self) -> Dict[str, Any]:
+        """Statements used by the temporary table strategy."""
+        table = _KEYS_TEMP_TABLE
+        return {
+            "create": text(f"CREATE TEMP TABLE IF NOT EXISTS {table} (key TEXT) ON COMMIT DELETE ROWS"),
+            "copy": f"COPY {table} (key) FROM STDIN",
+            "analyze": text(f"ANALYZE {table}"),
+            "select": text(
+                f"SELECT u.key FROM {self.record_model.__tablename__} u "
+                f"JOIN {table} t ON u.key = t.key WHERE u.namespace = :namespace"
+            ),
+            "delete": text(
+                f"DELETE FROM {self.record_model.__tablename__} u "
+                f"USING {table} t WHERE u.key = t.key AND u.namespace = :namespace"
+            ),
+        }
+
+    def _copy_keys(self, session: Session, keys: List[str]) -> None:
+        """COPY keys into the temporary table within the session's transaction."""
+        statements = self._temp_table_statements()
+        session.execute(statements["create"])
+        with session.connection().connection.driver_connection.cursor() as cursor:
+            with cursor.copy(statements["copy"]) as copy:
+                for key in keys:
+                    copy.write_row((key,))
+        session.execute(statements["analyze"])
+
+    async def _acopy_keys(self, session: AsyncSession, keys: List[str]) -> None:
+        """COPY keys into the temporary table within the session's transaction."""
+        statements = self._temp_table_statements()
+        await session.execute(statements["create"])
+        connection = await (await session.connection()).get_raw_connection()
+        async with connection.driver_connection.cursor() as cursor:
+            async with cursor.copy(statements["copy"]) as copy:
+                for key in keys:
+                    await copy.write_row((key,))
+        await session.execute(statements["analyze"])
+
+    def _scan_keys_query(self, fetch_size: int) -> Any:
+        """Stream every key of the namespace."""
+        return (
+            select(self.record_model.key)
+            .where(self.record_model.namespace == self.namespace)
+            .execution_options(yield_per=fetch_size)
+        )
+
+    def _count_keys_query(self) -> Any:
+        return select(func.count()).select_from(self.record_model).where(
+            self.record_model.namespace == self.namespace
+        )
+
+    def warm_membership_filter(
+        self,
+        *,
+        capacity: Optional[int] = None,
+        false_positive_rate: float = 0.01,
+        fetch_size: int = 10_000,
+    ) -> BloomFilter:
+        """Load every key of the namespace into a Bloom filter with one streaming scan.
 
-    def exists(self, keys: Sequence[str]) -> List[bool]:
-        """Check if the given keys exist in the PostgreSQL database."""
+        Afterwards exists() answers keys the filter reports as absent without
+        a query, and update() adds new keys to the filter. This assumes no
+        other process writes to the namespace while the filter is in use.
+        See utils.membership.BloomFilter for the memory used per key.
+
+        Args:
+            capacity: Number of keys to size the filter for. Defaults to twice
+                the current number of keys, with a minimum of 100,000.
+            false_positive_rate: Target rate of keys sent to the database
+                although they are absent.
+            fetch_size: Number of keys fetched per round trip during the scan.
+        """
         with self._make_session() as session:
-            filtered_query: Query = session.query(UpsertionRecord.key).filter(
-                and_(
-                    UpsertionRecord.key.in_(keys),
-                    UpsertionRecord.namespace == self.namespace,
-                )
-            )
-            records = filtered_query.all()
-        found_keys = set(r.key for r in records)
+            if capacity is None:
+                capacity = max(2 * session.execute(self._count_keys_query()).scalar_one(), 100_000)
+            membership_filter = BloomFilter(capacity, false_positive_rate)
+            membership_filter.update(session.scalars(self._scan_keys_query(fetch_size)))
+        self.membership_filter = membership_filter
+        return membership_filter
+
+    async def awarm_membership_filter(
+        self,
+        *,
+        capacity: Optional[int] = None,
+        false_positive_rate: float = 0.01,
+        fetch_size: int = 10_000,
+    ) -> BloomFilter:
+        """Load every key of the namespace into a Bloom filter with one streaming scan."""
+        async with self._amake_session() as session:
+            if capacity is None:
+                capacity = max(2 * (await session.execute(self._count_keys_query())).scalar_one(), 100_000)
+            membership_filter = BloomFilter(capacity, false_positive_rate)
+            async for key in await session.stream_scalars(self._scan_keys_query(fetch_size)):
+                membership_filter.add(key)
+        self.membership_filter = membership_filter
+        return membership_filter
+
+    def _membership_candidates(self, keys: Sequence[str]) -> Sequence[str]:
+        """Drop the keys the membership filter knows to be absent."""
+        if self.membership_filter is None:
+            return keys
+        return [key for key in keys if key in self.membership_filter]
+
+    def _find_keys(self, keys: Sequence[str]) -> Set[str]:
+        """Return the subset of keys present in the namespace."""
+        found_keys: Set[str] = set()
+        strategy = self._key_strategy(len(keys))
+        with self._make_session() as session:
+            for chunk in self._key_chunks(keys, strategy):
+                if strategy == "temp_table":
+                    self._copy_keys(session, chunk)
+                    query = self._temp_table_statements()["select"].bindparams(namespace=self.namespace)
+                    found_keys.update(session.execute(query).scalars())
+                    session.commit()
+                else:
+                    query = select(self.record_model.key).where(self._key_filter(chunk, strategy))
+                    found_keys.update(session.execute(query).scalars())
+        return found_keys
+
+    async def _afind_keys(self, keys: Sequence[str]) -> Set[str]:
+        """Return the subset of keys present in the namespace."""
+        found_keys: Set[str] = set()
+        strategy = self._key_strategy(len(keys))
+        async with self._amake_session() as session:
+            for chunk in self._key_chunks(keys, strategy):
+                if strategy == "temp_table":
+                    await self._acopy_keys(session, chunk)
+                    query = self._temp_table_statements()["select"].bindparams(namespace=self.namespace)
+                    found_keys.update((await session.execute(query)).scalars())
+                    await session.commit()
+                else:
+                    query = select(self.record_model.key).where(self._key_filter(chunk, strategy))
+                    found_keys.update((await session.execute(query)).scalars())
+        return found_keys
+
+    def exists(self, keys: Sequence[str]) -> List[bool]:
+        """Check if the given keys exist in the database."""
+        candidates = self._membership_candidates(keys)
+        found_keys = self._find_keys(candidates) if candidates else set()
         return [k in found_keys for k in keys]
 
     async def aexists(self, keys: Sequence[str]) -> List[bool]:
-        """Check if the given keys exist in the PostgreSQL database."""
-        async with self._amake_session() as session:
-            records = (
-                (
-                    await session.execute(
-                        select(UpsertionRecord.key).where(
-                            and_(
-                                UpsertionRecord.key.in_(keys),
-                                UpsertionRecord.namespace == self.namespace,
-                            )
-                        )
-                    )
-                )
-                .scalars()
-                .all()
-            )
-        found_keys = set(records)
+        """Check if the given keys exist in the database."""
+        candidates = self._membership_candidates(keys)
+        found_keys = await self._afind_keys(candidates) if candidates else set()
         return [k in found_keys for k in keys]
 
+    def _list_keys_query(
+        self,
+        *,
+        before: Optional[float] = None,
+        after: Optional[float] = None,
+        group_ids: Optional[Sequence[str]] = None,
+    ) -> Any:
+        """Select the keys of the namespace matching the date range and groups."""
+        query = select(self.record_model.key).where(
+            self.record_model.namespace == self.namespace
+        )
+
+        if after:
+            query = query.where(self.record_model.updated_at > after)
+        if before:
+            query = query.where(self.record_model.updated_at < before)
+        if group_ids:
+            query = query.where(self.record_model.group_id.in_(group_ids))
+        return query
+
+    def _keys_page_query(self, last_key: Optional[str], page_size: int, **filters: Any) -> Any:
+        """Select the page of keys that follows last_key, in key order."""
+        query = self._list_keys_query(**filters)
+        if last_key is not None:
+            query = query.where(self.record_model.key > last_key)
+        return query.order_by(self.record_model.key).limit(page_size)
+
     def list_keys(
         self,
         *,
@@ -334,23 +683,12 @@ class CustomSQLRecordManager(RecordManager):
         group_ids: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
     ) -> List[str]:
-        """List records in the PostgreSQL database based on the provided date range."""
+        """List records in the database based on the provided date range."""
+        query = self._list_keys_query(before=before, after=after, group_ids=group_ids)
+        if limit:
+            query = query.limit(limit)
         with self._make_session() as session:
-            query: Query = session.query(UpsertionRecord).filter(
-                UpsertionRecord.namespace == self.namespace
-            )
-
-            if after:
-                query = query.filter(UpsertionRecord.updated_at > after)
-            if before:
-                query = query.filter(UpsertionRecord.updated_at < before)
-            if group_ids:
-                query = query.filter(UpsertionRecord.group_id.in_(group_ids))
-
-            if limit:
-                query = query.limit(limit)
-            records = query.all()
-        return [r.key for r in records]
+            return list(session.execute(query).scalars().all())
 
     async def alist_keys(
         self,
@@ -360,47 +698,153 @@ class CustomSQLRecordManager(RecordManager):
         group_ids: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
     ) -> List[str]:
-        """List records in the PostgreSQL database based on the provided date range."""
+        """List records in the database based on the provided date range."""
+        query = self._list_keys_query(before=before, after=after, group_ids=group_ids)
+        if limit:
+            query = query.limit(limit)
         async with self._amake_session() as session:
-            query: Query = select(UpsertionRecord.key).filter(
-                UpsertionRecord.namespace == self.namespace
-            )
+            return list((await session.execute(query)).scalars().all())
+
+    def yield_keys(
+        self,
+        *,
+        before: Optional[float] = None,
+        after: Optional[float] = None,
+        group_ids: Optional[Sequence[str]] = None,
+        page_size: int = 1_000,
+    ) -> Generator[str, None, None]:
+        """Stream the keys list_keys would return, in key order.
+
+        Keys are fetched page_size at a time with keyset pagination
+        (key > last key seen), each page in its own short session, so memory
+        stays constant and each page is an index range scan. Keys may be
+        deleted while iterating.
+        """
+        last_key = None
+        filters = {"before": before, "after": after, "group_ids": group_ids}
+        while True:
+            with self._make_session() as session:
+                page = session.execute(self._keys_page_query(last_key, page_size, **filters)).scalars().all()
+            yield from page
+            if len(page) < page_size:
+                return
+            last_key = page[-1]
+
+    async def ayield_keys(
+        self,
+        *,
+        before: Optional[float] = None,
+        after: Optional[float] = None,
+        group_ids: Optional[Sequence[str]] = None,
+        page_size: int = 1_000,
+    ) -> AsyncGenerator[str, None]:
+        """Stream the keys list_keys would return, in key order."""
+        last_key = None
+        filters = {"before": before, "after": after, "group_ids": group_ids}
+        while True:
+            async with self._amake_session() as session:
+                page = (await session.execute(self._keys_page_query(last_key, page_size, **filters))).scalars().all()
+            for key in page:
+                yield key
+            if len(page) < page_size:
+                return
+            last_key = page[-1]
+
+    def _delete_stale_query(self, before: float, group_ids: Optional[List[str]], chunk_size: int) -> Any:
+        """Delete up to chunk_size stale keys of the namespace and return them."""
+        stale_keys = self._list_keys_query(before=before, group_ids=group_ids).limit(chunk_size)
+        return (
+            delete(self.record_model)
+            .where(self.record_model.namespace == self.namespace, self.record_model.key.in_(stale_keys))
+            .returning(self.record_model.key)
+            .execution_options(synchronize_session=False)
+        )
+
+    def _stale_group_chunks(self, group_ids: Optional[Sequence[str]]) -> List[Optional[List[str]]]:
+        """Split the group ids of a stale key deletion into IN-list chunks."""
+        if group_ids is None:
+            return [None]
+        return list(_batch(self.in_chunk_size, group_ids))
 
-            if after:
-                query = query.filter(UpsertionRecord.updated_at > after)
-            if before:
-                query = query.filter(UpsertionRecord.updated_at < before)
-            if group_ids:
-                query = query.filter(UpsertionRecord.group_id.in_(group_ids))
+    def delete_stale_keys(
+        self,
+        *,
+        before: float,
+        group_ids: Optional[Sequence[str]] = None,
+        chunk_size: int = 1_000,
+        before_commit: Optional[Callable[[List[str]], Any]] = None,
+    ) -> Generator[List[str], None, None]:
+        """Delete keys updated before a time and yield them chunk by chunk.
+
+        Each chunk is a single DELETE ... RETURNING key of at most chunk_size
+        rows, restricted to group_ids when given (an empty sequence deletes
+        nothing). before_commit is called with the chunk's keys inside its
+        transaction, e.g. to remove them from the vector store: if it raises,
+        the records stay in place. The chunk is committed before it is
+        yielded, so stopping the iteration never leaves records whose vectors
+        are gone. Work is proportional to the number of stale keys, not the
+        size of the namespace.
+        """
+        for group_chunk in self._stale_group_chunks(group_ids):
+            while True:
+                with self._make_session() as session:
+                    deleted = list(
+                        session.execute(self._delete_stale_query(before, group_chunk, chunk_size)).scalars().all()
+                    )
+                    if deleted and before_commit is not None:
+                        before_commit(deleted)
+                    session.commit()
+                if deleted:
+                    yield deleted
+                if len(deleted) < chunk_size:
+                    break
+
+    async def adelete_stale_keys(
+        self,
+        *,
+        before: float,
+        group_ids: Optional[Sequence[str]] = None,
+        chunk_size: int = 1_000,
+        before_commit: Optional[Callable[[List[str]], Awaitable[Any]]] = None,
+    ) -> AsyncGenerator[List[str], None]:
+        """Delete keys updated before a time and yield them chunk by chunk.
 
-            if limit:
-                query = query.limit(limit)
-            records = (await session.execute(query)).scalars().all()
-        return list(records)
+        Same as delete_stale_keys, with an async before_commit.
+        """
+        for group_chunk in self._stale_group_chunks(group_ids):
+            while True:
+                async with self._amake_session() as session:
+                    deleted = list(
+                        (await session.execute(self._delete_stale_query(before, group_chunk, chunk_size))).scalars().all()
+                    )
+                    if deleted and before_commit is not None:
+                        await before_commit(deleted)
+                    await session.commit()
+                if deleted:
+                    yield deleted
+                if len(deleted) < chunk_size:
+                    break
 
     def delete_keys(self, keys: Sequence[str]) -> None:
-        """Delete records from the PostgreSQL database."""
+        """Delete records from the database."""
+        strategy = self._key_strategy(len(keys))
         with self._make_session() as session:
-            filtered_query: Query = session.query(UpsertionRecord).filter(
-                and_(
-                    UpsertionRecord.key.in_(keys),
-                    UpsertionRecord.namespace == self.namespace,
-                )
-            )
-
-            filtered_query.delete()
-            session.commit()
+            for chunk in self._key_chunks(keys, strategy):
+                if strategy == "temp_table":
+                    self._copy_keys(session, chunk)
+                    session.execute(self._temp_table_statements()["delete"].bindparams(namespace=self.namespace))
+                else:
+                    session.execute(delete(self.record_model).where(self._key_filter(chunk, strategy)))
+                session.commit()
 
     async def adelete_keys(self, keys: Sequence[str]) -> None:
-        """Delete records from the PostgreSQL database."""
+        """Delete records from the database."""
+        strategy = self._key_strategy(len(keys))
         async with self._amake_session() as session:
-            await session.execute(
-                delete(UpsertionRecord).where(
-                    and_(
-                        UpsertionRecord.key.in_(keys),
-                        UpsertionRecord.namespace == self.namespace,
-                    )
-                )
-            )
-
-            await session.commit()
+            for chunk in self._key_chunks(keys, strategy):
+                if strategy == "temp_table":
+                    await self._acopy_keys(session, chunk)
+                    await session.execute(self._temp_table_statements()["delete"].bindparams(namespace=self.namespace))
+                else:
+                    await session.execute(delete(self.record_model).where(self._key_filter(chunk, strategy)))
+                await session.commit()
@@ -0,0 +1,124 @@
+# embedding_cache.py
+import re
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import BaseStore
+
+from utils.cache import LRUCache
+from utils.store import PostgresByteStore
+
+# Filename under which vectors are written to a PostgresByteStore
+EMBEDDING_CACHE_FILENAME = "embedding-cache"
+
+# Characters of model names that file-backed stores reject in keys
+_UNSAFE_KEY_CHARS = re.compile(r"[^a-zA-Z0-9_.\-]")
+
+
+class EmbeddingCache:
+    """Embeddings keyed by (model, content hash), so each text is embedded once.
+
+    index_with_ids looks vectors up by the content_hash of the hashed documents.
+    A renamed file or a paragraph repeated across sources therefore reuses
+    the stored vector, and only real misses reach the embedder.
+
+    Lookups go to the in-memory LRU tier first, then to the optional
+    persistent store, a BaseStore[str, bytes] such as PostgresByteStore
+    (under the filename EMBEDDING_CACHE_FILENAME) or LocalFileStore. Vectors
+    are stored as packed float64 bytes and come back exactly as the embedder
+    returned them.
+
+    Args:
+        embeddings: Embeddings used for cache misses.
+        model: Name of the embedding model. It is part of every key, so
+            changing models never returns stale vectors. Keys have the form
+            "<model>/<content hash>", with characters other than letters,
+            digits, "_", "." and "-" in the model name replaced by "_", so
+            they are valid LocalFileStore keys.
+        store: Optional persistent tier shared between runs and processes.
+        cache: In-memory tier. Defaults to an LRUCache of 10,000 vectors.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        store: Optional[BaseStore] = None,
+        cache: Optional[LRUCache] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self._key_prefix = _UNSAFE_KEY_CHARS.sub("_", model) + "/"
+        self.store = store
+        self.cache = cache if cache is not None else LRUCache(max_size=10_000)
+
+    def key(self, content_hash: str) -> str:
+        return self._key_prefix + content_hash
+
+    def _encode(self, vector: List[float]) -> bytes:
+        return array("d", vector).tobytes()
+
+    def _decode(self, value: bytes) -> List[float]:
+        return array("d", value).tolist()
+
+    def _write_items(self, vectors: Dict[str, List[float]]) -> List[Tuple]:
+        if isinstance(self.store, PostgresByteStore):
+            return [(key, self._encode(vector), EMBEDDING_CACHE_FILENAME) for key, vector in vectors.items()]
+        return [(key, self._encode(vector)) for key, vector in vectors.items()]
+
+    def _lookup(self, keys: List[str], stored: Sequence[Optional[bytes]]) -> Dict[str, List[float]]:
+        """Decode the values read from the store and fill the in-memory tier."""
+        found = {key: self._decode(value) for key, value in zip(keys, stored) if value is not None}
+        self.cache.put_many(found)
+        return found
+
+    def _assemble(
+        self, keys: List[str], found: Dict[str, List[float]], texts_to_embed: Dict[str, str]
+    ) -> Tuple[List[List[float]], int, int]:
+        """Return the vectors in input order with the hit and miss counts."""
+        misses = len(texts_to_embed)
+        return [found[key] for key in keys], len(keys) - misses, misses
+
+    def _missing_texts(self, texts: Sequence[str], keys: List[str], found: Dict[str, List[float]]) -> Dict[str, str]:
+        """Distinct keys left to embed, with their text."""
+        return {key: text for key, text in zip(keys, texts) if key not in found}
+
+    def embed_documents(self, texts: Sequence[str], content_hashes: Sequence[str]) -> Tuple[List[List[float]], int, int]:
+        """Return the vectors of texts and the number of cache hits and misses.
+
+        Repeats of the same content within texts are embedded once: each
+        distinct content embedded in this call counts as one miss, and every
+        other text as a hit.
+        """
+        keys = [self.key(content_hash) for content_hash in content_hashes]
+        found, missing = self.cache.get_many(list(dict.fromkeys(keys)))
+        if missing and self.store is not None:
+            found.update(self._lookup(missing, self.store.mget(missing)))
+
+        texts_to_embed = self._missing_texts(texts, keys, found)
+        if texts_to_embed:
+            vectors = dict(zip(texts_to_embed, self.embeddings.embed_documents(list(texts_to_embed.values()))))
+            if self.store is not None:
+                self.store.mset(self._write_items(vectors))
+            self.cache.put_many(vectors)
+            found.update(vectors)
+        return self._assemble(keys, found, texts_to_embed)
+
+    async def aembed_documents(
+        self, texts: Sequence[str], content_hashes: Sequence[str]
+    ) -> Tuple[List[List[float]], int, int]:
+        """Async version of embed_documents."""
+        keys = [self.key(content_hash) for content_hash in content_hashes]
+        found, missing = self.cache.get_many(list(dict.fromkeys(keys)))
+        if missing and self.store is not None:
+            found.update(self._lookup(missing, await self.store.amget(missing)))
+
+        texts_to_embed = self._missing_texts(texts, keys, found)
+        if texts_to_embed:
+            vectors = dict(zip(texts_to_embed, await self.embeddings.aembed_documents(list(texts_to_embed.values()))))
+            if self.store is not None:
+                await self.store.amset(self._write_items(vectors))
+            self.cache.put_many(vectors)
+            found.update(vectors)
+        return self._assemble(keys, found, texts_to_embed)
@@ -0,0 +1,133 @@
+# engines.py
+"""Process-wide registry of SQLAlchemy engines.
+
+PostgresByteStore, CustomSQLRecordManager and the text splitter helpers all
+talk to the same database. Creating an engine per component gives each one
+its own connection pool, so a single ingestion process can hold several pools
+against the same server. The functions below return one shared engine per
+(url, options) pair instead.
+
+Pool sizing: every engine keeps up to ``pool_size`` idle connections and opens
+up to ``max_overflow`` extra ones under load, so a process holds at most
+``pool_size + max_overflow`` connections per engine. Size ``pool_size`` for
+the number of threads or coroutines that use the database at the same time,
+and make sure the total over all processes stays below the server's
+``max_connections``. Defaults applied to PostgreSQL URLs are in
+DEFAULT_POOL_KWARGS; any engine keyword argument overrides them.
+
+SQLite engines (``sqlite:///path`` or ``sqlite+aiosqlite:///path``) get the
+SQLITE_PRAGMAS on every new connection: WAL journaling lets readers run
+while a writer commits, and synchronous=NORMAL only syncs at checkpoints.
+"""
+import threading
+from typing import Any, Dict, Tuple, Union
+
+from sqlalchemy import URL, Engine, create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+DEFAULT_POOL_KWARGS: Dict[str, Any] = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+}
+
+SQLITE_PRAGMAS: Dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -65536,  # 64 MB
+}
+
+_engines: Dict[Tuple[str, bool, str], Union[Engine, AsyncEngine]] = {}
+_lock = threading.Lock()
+
+
+def _engine_kwargs(url: URL, engine_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply the default pool options for server databases."""
+    if url.get_backend_name() != "postgresql":
+        return dict(engine_kwargs)
+    return {**DEFAULT_POOL_KWARGS, **engine_kwargs}
+
+
+def apply_sqlite_pragmas(engine: Union[Engine, AsyncEngine]) -> None:
+    """Run SQLITE_PRAGMAS on every new connection of a SQLite engine.
+
+    Engines from get_engine/get_async_engine are configured already; call
+    this for SQLite engines created elsewhere.
+    """
+    sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    def _set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(sync_engine, "connect", _set_pragmas)
+
+
+def _get_or_create(db_url: Union[str, URL], is_async: bool, engine_kwargs: Dict[str, Any]) -> Union[Engine, AsyncEngine]:
+    url = make_url(db_url)
+    kwargs = _engine_kwargs(url, engine_kwargs)
+    registry_key = (
+        url.render_as_string(hide_password=False),
+        is_async,
+        repr(sorted(kwargs.items())),
+    )
+    with _lock:
+        engine = _engines.get(registry_key)
+        if engine is None:
+            factory = create_async_engine if is_async else create_engine
+            engine = factory(url, **kwargs)
+            apply_sqlite_pragmas(engine)
+            _engines[registry_key] = engine
+        return engine
+
+
+def get_engine(db_url: Union[str, URL], **engine_kwargs: Any) -> Engine:
+    """Return the shared synchronous engine for a URL and options."""
+    return _get_or_create(db_url, False, engine_kwargs)
+
+
+def get_async_engine(db_url: Union[str, URL], **engine_kwargs: Any) -> AsyncEngine:
+    """Return the shared asynchronous engine for a URL and options."""
+    return _get_or_create(db_url, True, engine_kwargs)
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Return connection pool statistics for every registered engine.
+
+    ``checked_out`` connections are in use, ``checked_in`` are idle in the
+    pool and ``overflow`` counts connections opened beyond ``pool_size``
+    (negative while the pool has not been filled yet).
+    """
+    with _lock:
+        engines = list(_engines.items())
+    stats = {}
+    for (url, is_async, options), engine in engines:
+        pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+        name = f"{'async' if is_async else 'sync'} {make_url(url).render_as_string(hide_password=True)} {options}"
+        stats[name] = {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "status": pool.status(),
+        }
+    return stats
+
+
+def dispose_engines() -> None:
+    """Close every pooled connection and empty the registry."""
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        if isinstance(engine, AsyncEngine):
+            engine.sync_engine.dispose()
+        else:
+            engine.dispose()
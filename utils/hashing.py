@@ -0,0 +1,78 @@
+# hashing.py
+import hashlib
+from typing import Callable, Dict, Optional, Tuple
+
+# Algorithm used by _HashedDocument before hashing became configurable.
+# Document uids derived from it are kept stable by default.
+LEGACY_ALGORITHM = "sha1"
+
+# Default of every hash_algorithm option (hashed documents, index_with_ids,
+# PostgresByteStore), so all components hash the same way unless configured
+DEFAULT_ALGORITHM = LEGACY_ALGORITHM
+
+# One-byte ids prefixed to stored digests (see tag_digest), and digest sizes
+ALGORITHM_IDS: Dict[str, int] = {"sha1": 1, "sha256": 2, "blake2b": 3, "xxh128": 4}
+DIGEST_SIZES: Dict[str, int] = {"sha1": 20, "sha256": 32, "blake2b": 16, "xxh128": 16}
+
+
+def _blake2b_128(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _sha1(data: bytes) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+def _sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def _import_xxh128() -> Callable[[bytes], bytes]:
+    try:
+        import xxhash
+    except ImportError:
+        raise ImportError(
+            "Could not import xxhash python package. "
+            "Please install it with `pip install xxhash`."
+        )
+    return xxhash.xxh3_128_digest
+
+
+# Each entry returns the digest function, so optional packages are imported on use
+_HASHERS: Dict[str, Callable[[], Callable[[bytes], bytes]]] = {
+    "sha1": lambda: _sha1,
+    "sha256": lambda: _sha256,
+    "blake2b": lambda: _blake2b_128,
+    "xxh128": _import_xxh128,
+}
+
+
+def get_hasher(algorithm: str) -> Callable[[bytes], bytes]:
+    """Return a function computing the binary digest of bytes for the given algorithm.
+
+    Supported algorithms are sha1, sha256, blake2b (128-bit digest) and
+    xxh128. xxh128 requires the xxhash package and is not cryptographic.
+    """
+    if algorithm not in _HASHERS:
+        raise ValueError(
+            f"hash algorithm should be one of {sorted(_HASHERS)}. Got {algorithm}."
+        )
+    return _HASHERS[algorithm]()
+
+
+def tag_digest(algorithm: str, digest: bytes) -> bytes:
+    """Prefix a digest with the id of the algorithm that produced it."""
+    return bytes((ALGORITHM_IDS[algorithm],)) + digest
+
+
+def digest_algorithm(stored: bytes) -> Tuple[Optional[str], bytes]:
+    """Return the algorithm named by the tag of a stored digest, and the bare digest.
+
+    The algorithm is None when the tag is unknown or the digest length does
+    not match it.
+    """
+    ids = {algorithm_id: algorithm for algorithm, algorithm_id in ALGORITHM_IDS.items()}
+    algorithm = ids.get(stored[0]) if stored else None
+    if algorithm is None or len(stored) != 1 + DIGEST_SIZES[algorithm]:
+        return None, stored
+    return algorithm, stored[1:]
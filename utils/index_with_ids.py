@@ -1,104 +1,424 @@
 # index_with_ids.py
+import asyncio
+import time
+from collections import deque
 import logging
-from typing import Union, Iterable, Sequence, Callable, Optional, Dict, Literal, Set, cast
+from typing import Any, AsyncIterator, Deque, Iterator, Union, Iterable, Sequence, Callable, Optional, Dict, List, Literal, Set, Tuple, cast
 from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStore
 from langchain_core.indexing.base import RecordManager
-from utils import _HashedDocument, _deduplicate_in_order, _batch, _get_source_id_assigner
+from utils import _HashedRecord, _deduplicate_in_order, _batch, _get_source_id_assigner
+from utils.batching import AdaptiveBatcher
+from utils.embedding_cache import EmbeddingCache
+from utils.membership import RunDeduplicator
+from utils.parallel import hash_document_chunks
+from utils.hashing import DEFAULT_ALGORITHM
 
-def index_with_ids(
-    docs_source: Union[Iterable[Document]],
-    record_manager: RecordManager,
+def _check_index_arguments(
     vector_store: VectorStore,
-    *,
-    batch_size: int = 100,
-    cleanup: Literal["incremental", "full", None] = None,
-    source_id_key: Union[str, Callable[[Document], str], None] = None,
-    cleanup_batch_size: int = 1_000,
-    force_update: bool = False,
-) -> Dict:
-    """Index documents with unique IDs, and log detailed debug information."""
-    
+    cleanup: Optional[str],
+    source_id_key: Union[str, Callable[[Document], str], None],
+    methods: Sequence[str],
+) -> None:
+    """Validate the cleanup mode and the vector store methods used for indexing."""
     if cleanup not in {"incremental", "full", None}:
         raise ValueError(f"cleanup should be one of 'incremental', 'full' or None. Got {cleanup}.")
     
     if cleanup == "incremental" and source_id_key is None:
         raise ValueError("Source id key is required when cleanup mode is incremental.")
 
-    methods = ["delete", "add_documents"]
     for method in methods:
         if not hasattr(vector_store, method):
             raise ValueError(f"Vectorstore {vector_store} does not have required method {method}")
     if type(vector_store).delete == VectorStore.delete:
         raise ValueError("Vectorstore has not implemented the delete method")
 
-    doc_iterator = iter(docs_source)
 
-    source_id_assigner = _get_source_id_assigner(source_id_key)
+def _hashed_records(
+    docs_source: Iterable[Document],
+    hash_algorithm: str,
+    hash_workers: Optional[int],
+    hash_chunk_size: int,
+) -> Iterator[_HashedRecord]:
+    """Wrap documents in hashed records, hashing them on a process pool when hash_workers is set."""
+    if not hash_workers:
+        for doc in docs_source:
+            yield _HashedRecord.from_document(doc, hash_algorithm=hash_algorithm)
+        return
+    for chunk, hashes in hash_document_chunks(
+        docs_source, hash_algorithm=hash_algorithm, chunk_size=hash_chunk_size, max_workers=hash_workers
+    ):
+        for doc, doc_hashes in zip(chunk, hashes):
+            yield _HashedRecord.from_hashes(doc, doc_hashes, hash_algorithm=hash_algorithm)
 
-    index_start_dt = record_manager.get_time()
-    num_added = 0
-    num_skipped = 0
-    num_updated = 0
-    num_deleted = 0
-    results = []
-    all_hashed_docs = []  # Initialize to collect all hashed documents
-    ids_operations = []  # Initialize to collect ids and their operations
-
-    for doc_batch in _batch(batch_size, doc_iterator):
-        if not doc_batch:
-            continue
-        
-        hashed_docs = list(
-            _deduplicate_in_order(
-                [_HashedDocument.from_document(doc) for doc in doc_batch]
+
+def _hash_batch(
+    record_batch: Sequence[_HashedRecord],
+    source_id_assigner: Callable[[Document], Union[str, None]],
+    cleanup: Optional[str],
+) -> Tuple[List[_HashedRecord], Sequence[Optional[str]]]:
+    """Deduplicate a batch of hashed records, and assign the source id of each document."""
+    hashed_docs = list(_deduplicate_in_order(record_batch))
+
+    source_ids: Sequence[Optional[str]] = [
+        source_id_assigner(doc.to_document()) for doc in hashed_docs
+    ]
+
+    if cleanup == "incremental":
+        for source_id, hashed_doc in zip(source_ids, hashed_docs):
+            if source_id is None:
+                raise ValueError(
+                    "Source ids are required when cleanup mode is incremental. "
+                    f"Document that starts with content: {hashed_doc.page_content[:100]} was not assigned"
+                )
+    return hashed_docs, source_ids
+
+
+def _make_deduplicator(run_dedup: bool, run_dedup_max_bytes: Optional[int]) -> Optional[RunDeduplicator]:
+    """Create the deduplicator of one run; it is never shared between runs."""
+    return RunDeduplicator(max_bytes=run_dedup_max_bytes) if run_dedup else None
+
+
+def _drop_repeats(
+    hashed_docs: List[_HashedRecord],
+    source_ids: Sequence[Optional[str]],
+    deduplicator: Optional[RunDeduplicator],
+) -> Tuple[List[_HashedRecord], Sequence[Optional[str]], Dict[str, int]]:
+    """Drop the documents whose uid an earlier batch of the run already indexed or refreshed."""
+    if deduplicator is None:
+        return hashed_docs, source_ids, {}
+    kept = [i for i, doc in enumerate(hashed_docs) if deduplicator.add(doc.uid)]
+    repeat_counts = {"num_repeated": len(hashed_docs) - len(kept)}
+    return [hashed_docs[i] for i in kept], [source_ids[i] for i in kept], repeat_counts
+
+
+def _split_existing(
+    hashed_docs: Sequence[_HashedRecord], exists_batch: Sequence[bool], force_update: bool
+) -> Tuple[List[str], List[_HashedRecord], List[str], Set[str]]:
+    """Split a batch into documents to index and uids to refresh.
+
+    Returns the uids and documents to index, the uids to refresh only, and the
+    uids that already existed but are re-indexed because of force_update.
+    """
+    uids = []
+    docs_to_index = []
+    uids_to_refresh = []
+    seen_docs: Set[str] = set()
+    for hashed_doc, doc_exists in zip(hashed_docs, exists_batch):
+        if doc_exists:
+            if force_update:
+                seen_docs.add(hashed_doc.uid)
+            else:
+                uids_to_refresh.append(hashed_doc.uid)
+                continue
+        uids.append(hashed_doc.uid)
+        docs_to_index.append(hashed_doc)
+    return uids, docs_to_index, uids_to_refresh, seen_docs
+
+
+def _add_documents(
+    vector_store: VectorStore,
+    docs_to_index: List[_HashedRecord],
+    uids: List[str],
+    batch_size: int,
+    embedding_cache: Optional[EmbeddingCache],
+) -> Dict[str, int]:
+    """Add documents to the vector store; return the embedding cache hits and misses.
+
+    With an embedding cache, vectors are looked up by content hash and the
+    store receives them through add_embeddings, so only cache misses are
+    embedded.
+    """
+    if embedding_cache is None:
+        vector_store.add_documents([doc.to_document() for doc in docs_to_index], ids=uids, batch_size=batch_size)
+        return {}
+    texts = [doc.page_content for doc in docs_to_index]
+    vectors, hits, misses = embedding_cache.embed_documents(texts, [doc.content_hash for doc in docs_to_index])
+    vector_store.add_embeddings(texts, vectors, metadatas=[doc.metadata for doc in docs_to_index], ids=uids)
+    return {"num_embedding_hits": hits, "num_embedding_misses": misses}
+
+
+async def _aadd_documents(
+    vector_store: VectorStore,
+    docs_to_index: List[_HashedRecord],
+    uids: List[str],
+    batch_size: int,
+    embedding_cache: Optional[EmbeddingCache],
+) -> Dict[str, int]:
+    """Async version of _add_documents."""
+    if embedding_cache is None:
+        await vector_store.aadd_documents([doc.to_document() for doc in docs_to_index], ids=uids, batch_size=batch_size)
+        return {}
+    texts = [doc.page_content for doc in docs_to_index]
+    vectors, hits, misses = await embedding_cache.aembed_documents(texts, [doc.content_hash for doc in docs_to_index])
+    await vector_store.aadd_embeddings(texts, vectors, metadatas=[doc.metadata for doc in docs_to_index], ids=uids)
+    return {"num_embedding_hits": hits, "num_embedding_misses": misses}
+
+
+def _add_documents_batched(
+    vector_store: VectorStore,
+    docs_to_index: List[_HashedRecord],
+    uids: List[str],
+    batch_size: int,
+    embedding_cache: Optional[EmbeddingCache],
+    batcher: Optional[AdaptiveBatcher],
+    attempt: int = 0,
+) -> Dict[str, int]:
+    """Add documents in calls sized by the batcher, reporting each call's latency or error.
+
+    A failed call is split again with the reduced budget and retried, up to
+    the batcher's max_retries.
+    """
+    if batcher is None:
+        return _add_documents(vector_store, docs_to_index, uids, batch_size, embedding_cache)
+    counts: Dict[str, int] = {}
+    items = list(zip(docs_to_index, uids))
+    for call_items, tokens in batcher.batches(items, [doc.page_content for doc in docs_to_index]):
+        call_docs = [doc for doc, _ in call_items]
+        call_uids = [uid for _, uid in call_items]
+        start = time.perf_counter()
+        try:
+            call_counts = _add_documents(vector_store, call_docs, call_uids, len(call_docs), embedding_cache)
+        except Exception as error:
+            if not batcher.record_failure(error) or attempt >= batcher.max_retries:
+                raise
+            call_counts = _add_documents_batched(
+                vector_store, call_docs, call_uids, batch_size, embedding_cache, batcher, attempt + 1
+            )
+        else:
+            batcher.record_success(tokens, time.perf_counter() - start)
+        for name, count in call_counts.items():
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+async def _aadd_documents_batched(
+    vector_store: VectorStore,
+    docs_to_index: List[_HashedRecord],
+    uids: List[str],
+    batch_size: int,
+    embedding_cache: Optional[EmbeddingCache],
+    batcher: Optional[AdaptiveBatcher],
+    attempt: int = 0,
+) -> Dict[str, int]:
+    """Async version of _add_documents_batched."""
+    if batcher is None:
+        return await _aadd_documents(vector_store, docs_to_index, uids, batch_size, embedding_cache)
+    counts: Dict[str, int] = {}
+    items = list(zip(docs_to_index, uids))
+    for call_items, tokens in batcher.batches(items, [doc.page_content for doc in docs_to_index]):
+        call_docs = [doc for doc, _ in call_items]
+        call_uids = [uid for _, uid in call_items]
+        start = time.perf_counter()
+        try:
+            call_counts = await _aadd_documents(vector_store, call_docs, call_uids, len(call_docs), embedding_cache)
+        except Exception as error:
+            if not batcher.record_failure(error) or attempt >= batcher.max_retries:
+                raise
+            call_counts = await _aadd_documents_batched(
+                vector_store, call_docs, call_uids, batch_size, embedding_cache, batcher, attempt + 1
             )
+        else:
+            batcher.record_success(tokens, time.perf_counter() - start)
+        for name, count in call_counts.items():
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def _delete_stale_batches(
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    before: float,
+    group_ids: Optional[Iterable[str]],
+    cleanup_batch_size: int,
+) -> Iterator[List[str]]:
+    """Delete stale keys from the vector store and the record manager, and yield them batch by batch.
+
+    Each batch is gone from both before it is yielded, so a caller that stops
+    iterating never leaves records without vectors. Record managers with
+    delete_stale_keys delete each batch with one DELETE ... RETURNING
+    statement, committed only once the vector store delete succeeded. Others
+    list a batch with list_keys, delete the vectors, then the records.
+    """
+    if hasattr(record_manager, "delete_stale_keys"):
+        yield from record_manager.delete_stale_keys(
+            before=before, group_ids=group_ids, chunk_size=cleanup_batch_size, before_commit=vector_store.delete
         )
+        return
+    group_chunks = _batch(cleanup_batch_size, group_ids) if group_ids is not None else [None]
+    for group_chunk in group_chunks:
+        while uids_to_delete := record_manager.list_keys(before=before, group_ids=group_chunk, limit=cleanup_batch_size):
+            vector_store.delete(uids_to_delete)
+            record_manager.delete_keys(uids_to_delete)
+            yield uids_to_delete
+
+
+async def _adelete_stale_batches(
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    before: float,
+    group_ids: Optional[Iterable[str]],
+    cleanup_batch_size: int,
+) -> AsyncIterator[List[str]]:
+    """Async version of _delete_stale_batches."""
+    if hasattr(record_manager, "adelete_stale_keys"):
+        async for uids_to_delete in record_manager.adelete_stale_keys(
+            before=before, group_ids=group_ids, chunk_size=cleanup_batch_size, before_commit=vector_store.adelete
+        ):
+            yield uids_to_delete
+        return
+    group_chunks = _batch(cleanup_batch_size, group_ids) if group_ids is not None else [None]
+    for group_chunk in group_chunks:
+        while uids_to_delete := await record_manager.alist_keys(before=before, group_ids=group_chunk, limit=cleanup_batch_size):
+            await vector_store.adelete(uids_to_delete)
+            await record_manager.adelete_keys(uids_to_delete)
+            yield uids_to_delete
+
+
+def _batch_record(
+    operations: List[Dict[str, str]],
+    num_added: int = 0,
+    num_updated: int = 0,
+    num_skipped: int = 0,
+    num_deleted: int = 0,
+    **extra_counts: int,
+) -> Dict[str, Any]:
+    """Build the record yielded for one indexing or cleanup batch.
+
+    extra_counts holds num_embedding_hits and num_embedding_misses when an
+    embedding cache is used, and num_repeated with run-wide deduplication.
+    """
+    return {
+        "ids": operations,
+        "num_added": num_added,
+        "num_updated": num_updated,
+        "num_skipped": num_skipped,
+        "num_deleted": num_deleted,
+        **extra_counts,
+    }
+
+
+def _cleanup_record(uids_to_delete: List[str]) -> Dict[str, Any]:
+    return _batch_record(
+        [{"key": uid, "operation": "DEL"} for uid in uids_to_delete],
+        num_deleted=len(uids_to_delete),
+    )
+
+
+class _ResultCollector:
+    """Sum batch records into the result returned by index_with_ids."""
+
+    def __init__(self) -> None:
+        self.ids: List[Dict[str, str]] = []
+        self.counts = {"num_added": 0, "num_updated": 0, "num_skipped": 0, "num_deleted": 0}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        self.ids.extend(record["ids"])
+        for name, count in record.items():
+            if name != "ids":
+                self.counts[name] = self.counts.get(name, 0) + count
+
+    def result(self) -> Dict:
+        counts = dict(self.counts)
+        if "num_embedding_hits" in counts:
+            lookups = counts["num_embedding_hits"] + counts["num_embedding_misses"]
+            counts["embedding_cache_hit_ratio"] = counts["num_embedding_hits"] / lookups if lookups else 0.0
+        return {
+            "status": "success",
+            "ids": self.ids,  # Include ids and their operations
+            "results": [counts],
+        }
+
+
+def iter_index_with_ids(
+    docs_source: Union[Iterable[Document]],
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    *,
+    batch_size: int = 100,
+    cleanup: Literal["incremental", "full", None] = None,
+    source_id_key: Union[str, Callable[[Document], str], None] = None,
+    cleanup_batch_size: int = 1_000,
+    force_update: bool = False,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    embedding_batcher: Optional[AdaptiveBatcher] = None,
+    hash_workers: Optional[int] = None,
+    hash_chunk_size: int = 1_000,
+    run_dedup: bool = False,
+    run_dedup_max_bytes: Optional[int] = 256 * 2**20,
+) -> Iterator[Dict[str, Any]]:
+    """Index documents like index_with_ids, yielding one record per batch.
+
+    Each record holds the batch's "ids" operations and its num_added,
+    num_updated, num_skipped and num_deleted counts. Indexing batches are
+    yielded in input order, then one record per cleanup batch. Nothing is
+    kept between batches except the source ids needed for incremental
+    cleanup and, with run_dedup, the digests of the uids seen (at most
+    run_dedup_max_bytes), so memory is otherwise bounded by batch_size
+    whatever the input size.
+
+    With an embedding_cache, documents to index are embedded through the
+    cache and added with add_embeddings; records then also count
+    num_embedding_hits and num_embedding_misses. With an embedding_batcher,
+    the documents to index of each batch are sent in calls packed by
+    estimated tokens (see AdaptiveBatcher), so batch_size should be large
+    enough to fill the token budget.
 
-        all_hashed_docs.extend(hashed_docs)  # Collect all hashed documents
+    hash_workers > 0 hashes documents ahead of the batches on a pool of that
+    many processes, hash_chunk_size documents per task (see utils.parallel).
+    It pays off for initial loads of many documents; uids are unchanged.
 
-        source_ids: Sequence[Optional[str]] = [
-            source_id_assigner(doc.to_document()) for doc in hashed_docs
-        ]
+    With run_dedup, a document whose uid an earlier batch of the run already
+    indexed or refreshed is dropped without calling the record manager, like
+    repeats within a batch; records count them in num_repeated. Uids are
+    remembered exactly, up to run_dedup_max_bytes (see RunDeduplicator), so
+    a document is only dropped when its record was updated in this run. It
+    costs a few microseconds per document, so it is off by default and pays
+    off for inputs that repeat documents across batches.
+    """
+    _check_index_arguments(
+        vector_store, cleanup, source_id_key, ["delete", "add_embeddings" if embedding_cache else "add_documents"]
+    )
 
+    records = _hashed_records(docs_source, hash_algorithm, hash_workers, hash_chunk_size)
+    deduplicator = _make_deduplicator(run_dedup, run_dedup_max_bytes)
+
+    source_id_assigner = _get_source_id_assigner(source_id_key)
+
+    index_start_dt = record_manager.get_time()
+    seen_source_ids: Set[str] = set()
+
+    for record_batch in _batch(batch_size, records):
+        if not record_batch:
+            continue
+
+        hashed_docs, source_ids = _hash_batch(record_batch, source_id_assigner, cleanup)
         if cleanup == "incremental":
-            for source_id, hashed_doc in zip(source_ids, hashed_docs):
-                if source_id is None:
-                    raise ValueError(
-                        "Source ids are required when cleanup mode is incremental. "
-                        f"Document that starts with content: {hashed_doc.page_content[:100]} was not assigned"
-                    )
-            source_ids = cast(Sequence[str], source_ids)
+            seen_source_ids.update(cast(Sequence[str], source_ids))
+        hashed_docs, source_ids, repeat_counts = _drop_repeats(hashed_docs, source_ids, deduplicator)
+        if not hashed_docs:
+            yield _batch_record([], **repeat_counts)
+            continue
 
         exists_batch = record_manager.exists([doc.uid for doc in hashed_docs])
 
-        uids = []
-        docs_to_index = []
-        uids_to_refresh = []
-        seen_docs: Set[str] = set()
-        for hashed_doc, doc_exists in zip(hashed_docs, exists_batch):
-            if doc_exists:
-                if force_update:
-                    seen_docs.add(hashed_doc.uid)
-                else:
-                    uids_to_refresh.append(hashed_doc.uid)
-                    continue
-            uids.append(hashed_doc.uid)
-            docs_to_index.append(hashed_doc.to_document())
+        uids, docs_to_index, uids_to_refresh, seen_docs = _split_existing(hashed_docs, exists_batch, force_update)
+        operations = []
 
         if uids_to_refresh:
             record_manager.update(uids_to_refresh, time_at_least=index_start_dt)
-            num_skipped += len(uids_to_refresh)
             for uid in uids_to_refresh:
-                ids_operations.append({"key": uid, "operation": "SKIP"})
+                operations.append({"key": uid, "operation": "SKIP"})
 
+        embedding_counts = {"num_embedding_hits": 0, "num_embedding_misses": 0} if embedding_cache else {}
         if docs_to_index:
-            vector_store.add_documents(docs_to_index, ids=uids, batch_size=batch_size)
-            num_added += len(docs_to_index) - len(seen_docs)
-            num_updated += len(seen_docs)
+            embedding_counts = _add_documents_batched(
+                vector_store, docs_to_index, uids, batch_size, embedding_cache, embedding_batcher
+            )
             for uid in uids:
                 operation = "INS" if uid not in seen_docs else "UPD"
-                ids_operations.append({"key": uid, "operation": operation})
+                operations.append({"key": uid, "operation": operation})
 
         record_manager.update(
             [doc.uid for doc in hashed_docs],
@@ -106,36 +426,275 @@ def index_with_ids(
             time_at_least=index_start_dt,
         )
 
-    # Ensure all documents are checked for incremental cleanup before continuing
-    if cleanup == "incremental":
-        for source_id in source_ids:
-            if source_id is None:
-                raise AssertionError("Source ids cannot be None here.")
-        _source_ids = cast(Sequence[str], source_ids)
-        uids_to_delete = record_manager.list_keys(
-            group_ids=_source_ids, before=index_start_dt
+        yield _batch_record(
+            operations,
+            num_added=len(docs_to_index) - len(seen_docs),
+            num_updated=len(seen_docs),
+            num_skipped=len(uids_to_refresh),
+            **embedding_counts,
+            **repeat_counts,
         )
-        if uids_to_delete:
-            vector_store.delete(uids_to_delete)
-            record_manager.delete_keys(uids_to_delete)
-            num_deleted += len(uids_to_delete)
-            for uid in uids_to_delete:
-                ids_operations.append({"key": uid, "operation": "DEL"})
 
-    if cleanup == "full":
-        while uids_to_delete := record_manager.list_keys(
-            before=index_start_dt, limit=cleanup_batch_size
+    if cleanup is not None:
+        # Incremental cleanup covers every source seen in the run; full cleanup the whole namespace
+        group_ids = seen_source_ids if cleanup == "incremental" else None
+        for uids_to_delete in _delete_stale_batches(
+            record_manager, vector_store, index_start_dt, group_ids, cleanup_batch_size
         ):
-            vector_store.delete(uids_to_delete)
-            record_manager.delete_keys(uids_to_delete)
-            num_deleted += len(uids_to_delete)
-            for uid in uids_to_delete:
-                ids_operations.append({"key": uid, "operation": "DEL"})
+            yield _cleanup_record(uids_to_delete)
 
-    results.append({"num_added": num_added, "num_updated": num_updated, "num_skipped": num_skipped, "num_deleted": num_deleted})
 
-    return {
-        "status": "success",
-        "ids": ids_operations,  # Include ids and their operations
-        "results": results,
-    }
+def index_with_ids(
+    docs_source: Union[Iterable[Document]],
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    *,
+    batch_size: int = 100,
+    cleanup: Literal["incremental", "full", None] = None,
+    source_id_key: Union[str, Callable[[Document], str], None] = None,
+    cleanup_batch_size: int = 1_000,
+    force_update: bool = False,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    embedding_batcher: Optional[AdaptiveBatcher] = None,
+    hash_workers: Optional[int] = None,
+    hash_chunk_size: int = 1_000,
+    run_dedup: bool = False,
+    run_dedup_max_bytes: Optional[int] = 256 * 2**20,
+) -> Dict:
+    """Index documents with unique IDs and return every id with its operation.
+
+    The result lists one operation per document, so it grows with the input.
+    For large corpora iterate over iter_index_with_ids instead. With an
+    embedding_cache the results also report embedding_cache_hit_ratio.
+    """
+    collector = _ResultCollector()
+    for record in iter_index_with_ids(
+        docs_source,
+        record_manager,
+        vector_store,
+        batch_size=batch_size,
+        cleanup=cleanup,
+        source_id_key=source_id_key,
+        cleanup_batch_size=cleanup_batch_size,
+        force_update=force_update,
+        hash_algorithm=hash_algorithm,
+        embedding_cache=embedding_cache,
+        embedding_batcher=embedding_batcher,
+        hash_workers=hash_workers,
+        hash_chunk_size=hash_chunk_size,
+        run_dedup=run_dedup,
+        run_dedup_max_bytes=run_dedup_max_bytes,
+    ):
+        collector.add(record)
+    return collector.result()
+
+
+async def _aindex_batch(
+    hashed_docs: List[_HashedRecord],
+    source_ids: Sequence[Optional[str]],
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    *,
+    batch_size: int,
+    force_update: bool,
+    index_start_dt: float,
+    embedding_cache: Optional[EmbeddingCache],
+    embedding_batcher: Optional[AdaptiveBatcher],
+    repeat_counts: Dict[str, int],
+    earlier: Sequence["asyncio.Future[Dict[str, Any]]"],
+) -> Dict[str, Any]:
+    """Check, embed and record one hashed batch; return its batch record.
+
+    earlier holds the batches in flight when this one shares documents with
+    them. They are awaited before checking which documents exist, so the
+    shared documents are skipped as in the sync path instead of indexed twice.
+    """
+    if not hashed_docs:
+        return _batch_record([], **repeat_counts)
+    if earlier:
+        # Their failures are raised when they are reported, not here
+        await asyncio.wait(earlier)
+    operations = []
+
+    exists_batch = await record_manager.aexists([doc.uid for doc in hashed_docs])
+    uids, docs_to_index, uids_to_refresh, seen_docs = _split_existing(hashed_docs, exists_batch, force_update)
+
+    if uids_to_refresh:
+        await record_manager.aupdate(uids_to_refresh, time_at_least=index_start_dt)
+        for uid in uids_to_refresh:
+            operations.append({"key": uid, "operation": "SKIP"})
+
+    embedding_counts = {"num_embedding_hits": 0, "num_embedding_misses": 0} if embedding_cache else {}
+    if docs_to_index:
+        embedding_counts = await _aadd_documents_batched(
+            vector_store, docs_to_index, uids, batch_size, embedding_cache, embedding_batcher
+        )
+        for uid in uids:
+            operation = "INS" if uid not in seen_docs else "UPD"
+            operations.append({"key": uid, "operation": operation})
+
+    await record_manager.aupdate(
+        [doc.uid for doc in hashed_docs],
+        group_ids=source_ids,
+        time_at_least=index_start_dt,
+    )
+    return _batch_record(
+        operations,
+        num_added=len(docs_to_index) - len(seen_docs),
+        num_updated=len(seen_docs),
+        num_skipped=len(uids_to_refresh),
+        **embedding_counts,
+        **repeat_counts,
+    )
+
+
+async def aiter_index_with_ids(
+    docs_source: Union[Iterable[Document]],
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    *,
+    batch_size: int = 100,
+    cleanup: Literal["incremental", "full", None] = None,
+    source_id_key: Union[str, Callable[[Document], str], None] = None,
+    cleanup_batch_size: int = 1_000,
+    force_update: bool = False,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    max_concurrency: int = 4,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    embedding_batcher: Optional[AdaptiveBatcher] = None,
+    hash_workers: Optional[int] = None,
+    hash_chunk_size: int = 1_000,
+    run_dedup: bool = False,
+    run_dedup_max_bytes: Optional[int] = 256 * 2**20,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Async version of iter_index_with_ids that keeps several batches in flight.
+
+    Each batch runs aexists, aadd_documents and aupdate; up to max_concurrency
+    batches run at once, so embedding calls of one batch overlap with the
+    database work of others. Hashing runs in the event loop between batches,
+    or on the process pool when hash_workers is set. Records are yielded in
+    input order: a finished batch holds its slot in the window until every
+    earlier batch has been yielded. A batch holding a document of an earlier
+    batch of the run waits for the batches in flight before checking which
+    documents exist, so repeats are reported as SKIP, as in the sync path.
+    """
+    _check_index_arguments(
+        vector_store, cleanup, source_id_key, ["adelete", "aadd_embeddings" if embedding_cache else "aadd_documents"]
+    )
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency should be at least 1. Got {max_concurrency}.")
+
+    source_id_assigner = _get_source_id_assigner(source_id_key)
+
+    index_start_dt = await record_manager.aget_time()
+    seen_source_ids: Set[str] = set()
+
+    record_batches = _batch(batch_size, _hashed_records(docs_source, hash_algorithm, hash_workers, hash_chunk_size))
+    deduplicator = _make_deduplicator(run_dedup, run_dedup_max_bytes)
+    # Uids of the batches started so far; a batch holding one waits for the
+    # batches in flight. One batch at a time needs no tracking.
+    run_uids: Optional[Set[str]] = set() if max_concurrency > 1 else None
+    in_flight: Deque["asyncio.Task[Dict[str, Any]]"] = deque()
+    try:
+        while True:
+            if hash_workers:
+                # Wait for the process pool in a thread so batches in flight keep running
+                record_batch = await asyncio.to_thread(next, record_batches, None)
+            else:
+                record_batch = next(record_batches, None)
+            if record_batch is None:
+                break
+            hashed_docs, source_ids = _hash_batch(record_batch, source_id_assigner, cleanup)
+            if cleanup == "incremental":
+                seen_source_ids.update(cast(Sequence[str], source_ids))
+            hashed_docs, source_ids, repeat_counts = _drop_repeats(hashed_docs, source_ids, deduplicator)
+
+            # Bound the window: report the oldest batch before starting another
+            while len(in_flight) >= max_concurrency:
+                yield await in_flight.popleft()
+
+            earlier: List["asyncio.Task[Dict[str, Any]]"] = []
+            if run_uids is not None:
+                if any(doc.uid in run_uids for doc in hashed_docs):
+                    earlier = [task for task in in_flight if not task.done()]
+                run_uids.update(doc.uid for doc in hashed_docs)
+
+            in_flight.append(
+                asyncio.ensure_future(
+                    _aindex_batch(
+                        hashed_docs,
+                        source_ids,
+                        record_manager,
+                        vector_store,
+                        batch_size=batch_size,
+                        force_update=force_update,
+                        index_start_dt=index_start_dt,
+                        embedding_cache=embedding_cache,
+                        embedding_batcher=embedding_batcher,
+                        repeat_counts=repeat_counts,
+                        earlier=earlier,
+                    )
+                )
+            )
+
+        while in_flight:
+            yield await in_flight.popleft()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    if cleanup is not None:
+        group_ids = seen_source_ids if cleanup == "incremental" else None
+        async for uids_to_delete in _adelete_stale_batches(
+            record_manager, vector_store, index_start_dt, group_ids, cleanup_batch_size
+        ):
+            yield _cleanup_record(uids_to_delete)
+
+
+async def aindex_with_ids(
+    docs_source: Union[Iterable[Document]],
+    record_manager: RecordManager,
+    vector_store: VectorStore,
+    *,
+    batch_size: int = 100,
+    cleanup: Literal["incremental", "full", None] = None,
+    source_id_key: Union[str, Callable[[Document], str], None] = None,
+    cleanup_batch_size: int = 1_000,
+    force_update: bool = False,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    max_concurrency: int = 4,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    embedding_batcher: Optional[AdaptiveBatcher] = None,
+    hash_workers: Optional[int] = None,
+    hash_chunk_size: int = 1_000,
+    run_dedup: bool = False,
+    run_dedup_max_bytes: Optional[int] = 256 * 2**20,
+) -> Dict:
+    """Async version of index_with_ids that keeps several batches in flight.
+
+    See aiter_index_with_ids for how batches overlap. The result has the
+    same shape and operations as index_with_ids. Incremental cleanup covers
+    every source id seen during the run.
+    """
+    collector = _ResultCollector()
+    async for record in aiter_index_with_ids(
+        docs_source,
+        record_manager,
+        vector_store,
+        batch_size=batch_size,
+        cleanup=cleanup,
+        source_id_key=source_id_key,
+        cleanup_batch_size=cleanup_batch_size,
+        force_update=force_update,
+        hash_algorithm=hash_algorithm,
+        max_concurrency=max_concurrency,
+        embedding_cache=embedding_cache,
+        embedding_batcher=embedding_batcher,
+        hash_workers=hash_workers,
+        hash_chunk_size=hash_chunk_size,
+        run_dedup=run_dedup,
+        run_dedup_max_bytes=run_dedup_max_bytes,
+    ):
+        collector.add(record)
+    return collector.result()
@@ -0,0 +1,109 @@
+# parallel.py
+"""Process-pool stages for bulk ingestion.
+
+Work is sent to the pool in chunks, with at most ``window`` chunks in
+flight, and results come back in input order. The input is read only as
+fast as the pool keeps up, so an input of millions of documents never sits
+in memory at once. Worker functions live at module level so they can be
+pickled by every multiprocessing start method.
+"""
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain_core.documents import Document
+
+from utils.hashing import DEFAULT_ALGORITHM
+from utils.utils import HashTriple, _batch, _hash_document_strings
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_chunk_map(
+    fn: Callable[..., List[R]],
+    chunks: Iterable[T],
+    *args: Any,
+    payload: Optional[Callable[[T], Any]] = None,
+    max_workers: Optional[int] = None,
+    window: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[Tuple[T, List[R]]]:
+    """Yield (chunk, fn(chunk, *args)) in input order, computed on a process pool.
+
+    payload, when given, converts each chunk to what is sent to the worker
+    instead of the chunk itself (e.g. only the strings it needs), while the
+    chunk is still yielded. Up to window chunks (default twice the number
+    of workers) are in flight. An executor can be passed to reuse a pool across calls; otherwise one is
+    created with max_workers processes and shut down at the end.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    window = window or 2 * (max_workers or os.cpu_count() or 1)
+    in_flight: Deque[Tuple[T, "Future[List[R]]"]] = deque()
+    try:
+        for chunk in chunks:
+            if len(in_flight) >= window:
+                done_chunk, future = in_flight.popleft()
+                yield done_chunk, future.result()
+            in_flight.append((chunk, executor.submit(fn, payload(chunk) if payload else chunk, *args)))
+        while in_flight:
+            done_chunk, future = in_flight.popleft()
+            yield done_chunk, future.result()
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _hash_chunk(pairs: List[Tuple[str, str]], hash_algorithm: str) -> List[HashTriple]:
+    """Hash (page_content, source) pairs the way _HashedRecord does."""
+    return [_hash_document_strings(content, source, hash_algorithm) for content, source in pairs]
+
+
+def _hash_inputs(docs: List[Document]) -> List[Tuple[str, str]]:
+    # Only the two hashed strings are pickled to the workers, not the documents
+    return [(doc.page_content, doc.metadata.get("source", "")) for doc in docs]
+
+
+def hash_document_chunks(
+    docs: Iterable[Document],
+    *,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    chunk_size: int = 1_000,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[Tuple[List[Document], List[HashTriple]]]:
+    """Hash documents on a process pool; yield each chunk with its hash triples."""
+    yield from ordered_chunk_map(
+        _hash_chunk,
+        _batch(chunk_size, docs),
+        hash_algorithm,
+        payload=_hash_inputs,
+        max_workers=max_workers,
+        executor=executor,
+    )
+
+
+def hash_documents(
+    docs: Iterable[Document],
+    *,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    chunk_size: int = 1_000,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[HashTriple]:
+    """Yield (uid, content_hash, source_hash) of every document, in input order.
+
+    Documents are hashed chunk_size at a time on a pool of max_workers
+    processes (default: one per core). The values are those of
+    _HashedRecord.from_document with the same hash_algorithm, duplicates
+    included.
+    """
+    for _, hashed in hash_document_chunks(
+        docs, hash_algorithm=hash_algorithm, chunk_size=chunk_size, max_workers=max_workers, executor=executor
+    ):
+        yield from hashed
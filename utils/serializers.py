@@ -0,0 +1,172 @@
+# serializers.py
+import json
+import pickle
+import zlib
+from typing import Any, Dict, Optional
+
+from langchain_core.documents.base import Document
+
+# Every value written by a Codec starts with a two byte header:
+#   byte 0: format version (one of the FORMAT_* constants)
+#   byte 1: compression applied to the payload (one of the COMPRESSION_* constants)
+# Values written before codecs existed are raw pickles, which start with the
+# pickle PROTO opcode (0x80) and are recognised by that first byte.
+FORMAT_JSON = 0x01
+FORMAT_MSGPACK = 0x02
+FORMAT_PICKLE = 0x03
+
+COMPRESSION_NONE = 0x00
+COMPRESSION_ZLIB = 0x01
+COMPRESSION_ZSTD = 0x02
+
+PICKLE_PROTO = 0x80
+
+
+def _import_msgpack() -> Any:
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError(
+            "Could not import msgpack python package. "
+            "Please install it with `pip install msgpack`."
+        )
+    return msgpack
+
+
+def _import_zstd() -> Any:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "Could not import zstandard python package. "
+            "Please install it with `pip install zstandard`."
+        )
+    return zstandard
+
+
+def _to_record(value: Any) -> Dict[str, Any]:
+    """Convert a value to a plain record that JSON and msgpack can encode."""
+    if isinstance(value, Document):
+        record = {"t": "d", "c": value.page_content, "m": value.metadata}
+        doc_id = getattr(value, "id", None)
+        if doc_id is not None:
+            record["i"] = doc_id
+        return record
+    return {"t": "v", "v": value}
+
+
+def _from_record(record: Dict[str, Any]) -> Any:
+    """Rebuild the value stored by _to_record."""
+    if record["t"] == "d":
+        if "i" in record:
+            return Document(page_content=record["c"], metadata=record["m"], id=record["i"])
+        return Document(page_content=record["c"], metadata=record["m"])
+    return record["v"]
+
+
+class Codec:
+    """Versioned encoding of docstore values.
+
+    The default "pickle" format pickles values behind a two byte header:
+    every Python type round-trips and encoding is the fastest. Unlike the
+    previous serializer it does not convert dictionaries to key-sorted
+    OrderedDicts first, so they come back as plain dicts. "json" and
+    "msgpack" store Documents as their page_content, metadata and id only,
+    and never run code when decoding, but they are lossy: tuples come back
+    as lists, dictionary keys must be strings (json turns int keys into
+    strings), and values such as date, datetime or Decimal in metadata raise
+    TypeError when encoding.
+
+    Payloads of at least compression_threshold bytes can be compressed with
+    zlib or zstd. Decoding reads the header, so a single codec can read
+    values written with any format or compression, including the headerless
+    pickles of the previous serializer. Pickled values are read only when
+    allow_pickle is True, since unpickling runs arbitrary code from the
+    database.
+
+    Args:
+        format: "pickle" (default), "json" or "msgpack". msgpack requires the msgpack package.
+        compression: None (default), "zlib" or "zstd". zstd requires the zstandard package.
+        compression_threshold: Minimum payload size in bytes before compressing.
+        compression_level: Compression level passed to zlib or zstd.
+        allow_pickle: Whether pickled values may be decoded. Must be True with format="pickle".
+    """
+
+    def __init__(
+        self,
+        format: str = "pickle",
+        compression: Optional[str] = None,
+        compression_threshold: int = 512,
+        compression_level: int = 3,
+        allow_pickle: bool = True,
+    ) -> None:
+        if format not in ("pickle", "json", "msgpack"):
+            raise ValueError(f"format should be one of 'pickle', 'json' or 'msgpack'. Got {format}.")
+        if format == "pickle" and not allow_pickle:
+            raise ValueError("format='pickle' requires allow_pickle=True.")
+        if compression not in (None, "zlib", "zstd"):
+            raise ValueError(f"compression should be one of None, 'zlib' or 'zstd'. Got {compression}.")
+        self._msgpack = _import_msgpack() if format == "msgpack" else None
+        self._zstd_compressor = (
+            _import_zstd().ZstdCompressor(level=compression_level) if compression == "zstd" else None
+        )
+
+        self.format = format
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self.allow_pickle = allow_pickle
+
+    def encode(self, value: Any) -> bytes:
+        if self.format == "pickle":
+            version = FORMAT_PICKLE
+            payload = pickle.dumps(value)
+        elif self.format == "msgpack":
+            version = FORMAT_MSGPACK
+            payload = self._msgpack.packb(_to_record(value), use_bin_type=True)
+        else:
+            version = FORMAT_JSON
+            payload = json.dumps(
+                _to_record(value), sort_keys=True, separators=(",", ":"), ensure_ascii=False
+            ).encode("utf-8")
+
+        compression = COMPRESSION_NONE
+        if self.compression and len(payload) >= self.compression_threshold:
+            if self.compression == "zstd":
+                compressed = self._zstd_compressor.compress(payload)
+                candidate = COMPRESSION_ZSTD
+            else:
+                compressed = zlib.compress(payload, self.compression_level)
+                candidate = COMPRESSION_ZLIB
+            # Keep the raw payload when compression does not pay off
+            if len(compressed) < len(payload):
+                payload, compression = compressed, candidate
+
+        return bytes((version, compression)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        version = data[0]
+        if version == PICKLE_PROTO:
+            if not self.allow_pickle:
+                raise ValueError("Refusing to load a pickled value because allow_pickle is False.")
+            return pickle.loads(data)
+
+        compression, payload = data[1], data[2:]
+        if compression == COMPRESSION_ZLIB:
+            payload = zlib.decompress(payload)
+        elif compression == COMPRESSION_ZSTD:
+            payload = _import_zstd().ZstdDecompressor().decompress(payload)
+        elif compression != COMPRESSION_NONE:
+            raise ValueError(f"Unknown compression id {compression}.")
+
+        if version == FORMAT_PICKLE:
+            if not self.allow_pickle:
+                raise ValueError("Refusing to load a pickled value because allow_pickle is False.")
+            return pickle.loads(payload)
+        if version == FORMAT_JSON:
+            record = json.loads(payload)
+        elif version == FORMAT_MSGPACK:
+            record = _import_msgpack().unpackb(payload, raw=False)
+        else:
+            raise ValueError(f"Unknown value format version {version}.")
+        return _from_record(record)
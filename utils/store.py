@@ -1,12 +1,15 @@
-from sqlalchemy import create_engine, Column, String, LargeBinary, select, delete
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import inspect, make_url, text, Column, String, LargeBinary, Index, select, delete, update, bindparam, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-import pickle
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import hashlib
-from collections import OrderedDict
 from langchain_core.stores import BaseStore
 from langchain_core.documents.base import Document
+from utils.serializers import Codec
+from utils.hashing import DEFAULT_ALGORITHM, digest_algorithm, get_hasher, tag_digest
+from utils.engines import get_engine, get_async_engine
 
 Base = declarative_base()
 
@@ -15,43 +18,149 @@ class ByteStore(Base):
     collection_name = Column(String, primary_key=True)
     key = Column(String, primary_key=True)
     value = Column(LargeBinary)
-    value_hash = Column(String)  # New field for storing the hash of the value
+    value_hash = Column(String)  # Legacy SHA-256 hex digest, kept until migrate_hashes() replaces it
+    value_digest = Column(LargeBinary)  # Binary digest prefixed with the id of its hash algorithm (see utils.hashing)
     filename = Column(String, primary_key=True)  # Include filename as part of the primary key
 
+    __table_args__ = (
+        # Serves the per-file hash lookups of conditional_mset
+        Index('ix_bytestore_collection_filename', 'collection_name', 'filename'),
+        # Serves the LIKE 'prefix%' scans of yield_keys whatever the database collation
+        Index('ix_bytestore_collection_key_pattern', 'collection_name', 'key', postgresql_ops={'key': 'text_pattern_ops'}),
+    )
+
 class PostgresByteStore(BaseStore):
-    def __init__(self, conninfo, collection_name):
+    def __init__(self, conninfo, collection_name, chunk_size=500, codec=None, cache=None, hash_algorithm=DEFAULT_ALGORITHM, engine_kwargs=None):
         self.conninfo = conninfo
         self.collection_name = collection_name
-
-        # Engines for synchronous and asynchronous operations
-        self.engine = create_engine(conninfo)
-        self.async_engine = create_async_engine(conninfo)
+        # Maximum number of rows sent in a single multi-row upsert statement
+        self.chunk_size = chunk_size
+        # Encodes stored values (pickle by default); it also reads rows pickled by earlier versions
+        self.codec = codec or Codec()
+        # Optional read-through cache (e.g. LRUCache) for get/mget; invalidated by local writes
+        self.cache = cache
+        # Digest function used for change detection (see utils.hashing). Rows hashed
+        # with another algorithm are still recognised by their algorithm tag.
+        self.hash_algorithm = hash_algorithm
+        self.hasher = get_hasher(hash_algorithm)
+
+        # Engine for synchronous operations, shared process-wide (see utils.engines).
+        # The async engine is created on first use, so URLs without an async
+        # driver (e.g. plain sqlite://) work with the synchronous methods.
+        self.engine_kwargs = engine_kwargs or {}
+        self.engine = get_engine(conninfo, **self.engine_kwargs)
+        self._async_engine = None
+        self._async_session_factory = None
 
         # Metadata setup
         Base.metadata.bind = self.engine
         Base.metadata.create_all(self.engine)
+        self.upgrade_schema()
 
-        # Session factories for synchronous and asynchronous operations
+        # Session factory for synchronous operations
         self.Session = scoped_session(sessionmaker(bind=self.engine))
-        self.async_session_factory = sessionmaker(self.async_engine, class_=AsyncSession, expire_on_commit=False)
 
-    # Helper function to compute the hash
+    # Engine for asynchronous operations, created on first use. The URL needs an
+    # async driver (e.g. postgresql+psycopg); plain sqlite:// URLs use aiosqlite.
+    @property
+    def async_engine(self):
+        if self._async_engine is None:
+            url = make_url(self.conninfo)
+            if url.drivername == 'sqlite':
+                url = url.set(drivername='sqlite+aiosqlite')
+            self._async_engine = get_async_engine(url, **self.engine_kwargs)
+        return self._async_engine
+
+    @property
+    def async_session_factory(self):
+        if self._async_session_factory is None:
+            self._async_session_factory = sessionmaker(self.async_engine, class_=AsyncSession, expire_on_commit=False)
+        return self._async_session_factory
+
+    # create_all only creates missing tables; add the columns and indexes
+    # introduced since the table was first created
+    def upgrade_schema(self):
+        columns = {column['name'] for column in inspect(self.engine).get_columns(ByteStore.__tablename__)}
+        if 'value_digest' not in columns:
+            column_type = ByteStore.__table__.c.value_digest.type.compile(dialect=self.engine.dialect)
+            with self.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {ByteStore.__tablename__} ADD COLUMN value_digest {column_type}'))
+        for index in ByteStore.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+
+    # Hashable content as bytes; bytes values (e.g. packed vectors) are hashed as they are
+    def content_bytes(self, content):
+        return content if isinstance(content, bytes) else content.encode('utf-8')
+
+    # Helper function to compute the tagged binary digest of the hashable content
     def compute_hash(self, content):
-        hash_obj = hashlib.sha256(content.encode('utf-8'))
-        return hash_obj.hexdigest()
-
-    # Helper function to serialize value with consistent ordering
+        return tag_digest(self.hash_algorithm, self.hasher(self.content_bytes(content)))
+
+    # SHA-256 hex digest stored in value_hash by earlier versions
+    def compute_legacy_hash(self, content):
+        return hashlib.sha256(self.content_bytes(content)).hexdigest()
+
+    # Compares a stored row with new content. A digest written with another hash
+    # algorithm is checked by rehashing the content with that algorithm, so
+    # changing hash_algorithm does not mark unchanged rows as updated. Rows written
+    # by earlier versions only have the hex value_hash, checked with the legacy hash.
+    def hash_matches(self, value_digest, value_hash, hashable_content, new_digest):
+        if value_digest is not None:
+            value_digest = bytes(value_digest)
+            if value_digest == new_digest:
+                return True
+            # Rows hashed with another algorithm are compared by rehashing with it
+            algorithm, digest = digest_algorithm(value_digest)
+            if algorithm is None or algorithm == self.hash_algorithm:
+                return False
+            try:
+                hasher = get_hasher(algorithm)
+            except ImportError:
+                return False
+            return hasher(self.content_bytes(hashable_content)) == digest
+        if value_hash is not None:
+            return value_hash == self.compute_legacy_hash(hashable_content)
+        return False
+
+    # Replaces legacy hex hashes with binary digests, chunk_size rows at a time.
+    # Returns the number of rows migrated.
+    def migrate_hashes(self):
+        migrated = 0
+        stmt = update(ByteStore).where(
+            ByteStore.collection_name == self.collection_name,
+            ByteStore.key == bindparam('b_key'),
+            ByteStore.filename == bindparam('b_filename'),
+        ).values(value_digest=bindparam('b_digest'), value_hash=None)
+        while True:
+            with self.Session() as session:
+                rows = session.execute(
+                    select(ByteStore.key, ByteStore.filename, ByteStore.value).where(
+                        ByteStore.collection_name == self.collection_name,
+                        ByteStore.value_digest.is_(None)
+                    ).limit(self.chunk_size)
+                ).all()
+                if not rows:
+                    return migrated
+                params = [
+                    {
+                        'b_key': row.key,
+                        'b_filename': row.filename,
+                        'b_digest': self.compute_hash(self.extract_hashable_content(self.deserialize_value(row.value))),
+                    }
+                    for row in rows
+                ]
+                session.connection().execute(stmt, params)
+                session.commit()
+            self.invalidate_cache(row.key for row in rows)
+            migrated += len(rows)
+
+    # Helper function to serialize a value with the store's codec
     def serialize_value(self, value):
-        return pickle.dumps(self.recursive_ordered_dict(value))
-
-    # Recursive function to convert dictionaries to OrderedDicts
-    def recursive_ordered_dict(self, obj):
-        if isinstance(obj, dict):
-            return OrderedDict((k, self.recursive_ordered_dict(v)) for k, v in sorted(obj.items()))
-        elif isinstance(obj, list):
-            return [self.recursive_ordered_dict(v) for v in obj]
-        else:
-            return obj
+        return self.codec.encode(value)
+
+    # Helper function to deserialize a stored value, whatever codec wrote it
+    def deserialize_value(self, data):
+        return self.codec.decode(data)
 
     # Extracts the relevant part of the value to be hashed
     def extract_hashable_content(self, value):
@@ -59,227 +168,277 @@ class PostgresByteStore(BaseStore):
             return value.page_content
         elif isinstance(value, dict):
             return value.get('page_content', '')
+        elif isinstance(value, (bytes, bytearray)):
+            return bytes(value)
         else:
             return str(value)
 
+    # Builds the row dictionary stored for a (key, value, filename) item
+    def build_row(self, key, value, filename, value_digest=None):
+        if value_digest is None:
+            value_digest = self.compute_hash(self.extract_hashable_content(value))
+        return {
+            'collection_name': self.collection_name,
+            'key': key,
+            'value': self.serialize_value(value),
+            'value_hash': None,
+            'value_digest': value_digest,
+            'filename': filename,
+        }
+
+    # Builds a multi-row INSERT ... ON CONFLICT DO UPDATE for the current dialect
+    def upsert_statement(self, rows):
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            stmt = pg_insert(ByteStore).values(rows)
+        elif dialect == 'sqlite':
+            stmt = sqlite_insert(ByteStore).values(rows)
+        else:
+            raise NotImplementedError(f"Not implemented for dialect {dialect}")
+        return stmt.on_conflict_do_update(
+            index_elements=[ByteStore.collection_name, ByteStore.key, ByteStore.filename],
+            set_={
+                'value': stmt.excluded.value,
+                'value_hash': stmt.excluded.value_hash,
+                'value_digest': stmt.excluded.value_digest,
+            },
+        )
+
+    # Splits rows into upsert statements of at most chunk_size rows.
+    # Duplicate (key, filename) pairs keep the last value, like successive merge() calls.
+    def upsert_statements(self, rows, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        unique_rows = list({(row['key'], row['filename']): row for row in rows}.values())
+        for start in range(0, len(unique_rows), chunk_size):
+            yield self.upsert_statement(unique_rows[start:start + chunk_size])
+
+    # Selects only keys, filenames and hashes of the files touched by a batch,
+    # so the diff never loads the stored values. Filenames are chunked to bound
+    # the number of bind parameters per statement.
+    def existing_hashes_queries(self, items):
+        filenames = sorted({filename for _, _, filename in items})
+        for start in range(0, len(filenames), self.chunk_size):
+            yield select(ByteStore.key, ByteStore.filename, ByteStore.value_hash, ByteStore.value_digest).where(
+                ByteStore.collection_name == self.collection_name,
+                ByteStore.filename.in_(filenames[start:start + self.chunk_size])
+            )
+
+    # Deletes (key, filename) pairs across any number of files in chunked set-based statements
+    def delete_statements(self, pairs):
+        pairs = sorted(pairs)
+        for start in range(0, len(pairs), self.chunk_size):
+            yield delete(ByteStore).where(
+                ByteStore.collection_name == self.collection_name,
+                tuple_(ByteStore.key, ByteStore.filename).in_(pairs[start:start + self.chunk_size])
+            )
+
+    # Works out the DEL/INS/UPD/SKIP operations of a batch that may span many files.
+    # Keys stored for a file in the batch but missing from the batch are deleted.
+    # Only inserted and updated items are serialized.
+    def diff_items(self, items, existing_rows):
+        existing_rows = {(row.key, row.filename): row for row in existing_rows}
+        item_pairs = {(key, filename) for key, _, filename in items}
+        pairs_to_delete = set(existing_rows) - item_pairs
+        modified_keys = [(key, 'DEL') for key, _ in sorted(pairs_to_delete)]
+        rows_to_write = []
+        for key, value, filename in items:
+            hashable_content = self.extract_hashable_content(value)
+            new_digest = self.compute_hash(hashable_content)
+            existing = existing_rows.get((key, filename))
+            if existing is not None:
+                if self.hash_matches(existing.value_digest, existing.value_hash, hashable_content, new_digest):
+                    modified_keys.append((key, 'SKIP'))
+                    continue
+                modified_keys.append((key, 'UPD'))
+            else:
+                modified_keys.append((key, 'INS'))
+            rows_to_write.append(self.build_row(key, value, filename, value_digest=new_digest))
+        return modified_keys, pairs_to_delete, rows_to_write
+
+    # Splits keys into cached values and the distinct keys to fetch from the database,
+    # along with the cache generation to pass to cache_results once they are fetched
+    def cached_lookup(self, keys):
+        if self.cache is None:
+            return {}, list(dict.fromkeys(keys)), None
+        generation = self.cache.generation()
+        found, missing = self.cache.get_many(keys)
+        return found, list(dict.fromkeys(missing)), generation
+
+    # Keys invalidated by a write since the lookup are not cached
+    def cache_results(self, results, generation=None):
+        if self.cache is not None and results:
+            self.cache.put_many(results, generation)
+
+    def invalidate_cache(self, keys):
+        if self.cache is not None:
+            self.cache.invalidate(keys)
+
+    # Hit/miss counters of the read cache, or None without a cache
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def values_query(self, keys):
+        return select(ByteStore.key, ByteStore.value).where(ByteStore.collection_name == self.collection_name, ByteStore.key.in_(keys))
+
+    # Keys of the collection, optionally restricted to a prefix. Wildcards in the
+    # prefix are escaped so they match literally.
+    def keys_query(self, prefix=None):
+        query = select(ByteStore.key).where(ByteStore.collection_name == self.collection_name)
+        if prefix:
+            escaped = prefix.replace('/', '//').replace('%', '/%').replace('_', '/_')
+            query = query.where(ByteStore.key.like(f'{escaped}%', escape='/'))
+        return query
+
     # Synchronous methods
     def get(self, key):
-        with self.Session() as session:
-            result = session.execute(select(ByteStore).filter_by(collection_name=self.collection_name, key=key)).scalar()
-            return pickle.loads(result.value) if result else None
+        return self.mget([key])[0]
 
     def set(self, key, value, filename):
-        with self.Session() as session:
-            serialized_value = self.serialize_value(value)
-            hashable_content = self.extract_hashable_content(value)
-            entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=self.compute_hash(hashable_content), filename=filename)
-            session.merge(entry)
-            session.commit()
+        self.mset([(key, value, filename)])
 
     def mget(self, keys):
-        results = {}
-        with self.Session() as session:
-            query_results = session.execute(select(ByteStore).where(ByteStore.collection_name == self.collection_name, ByteStore.key.in_(keys))).scalars()
-            for result in query_results:
-                results[result.key] = pickle.loads(result.value)
+        results, missing, generation = self.cached_lookup(keys)
+        if missing:
+            fetched = {}
+            with self.Session() as session:
+                for result in session.execute(self.values_query(missing)):
+                    fetched[result.key] = self.deserialize_value(result.value)
+            self.cache_results(fetched, generation)
+            results.update(fetched)
         return [results.get(key) for key in keys]
 
-    def mset(self, items):
+    def mset(self, items, chunk_size=None):
+        rows = [self.build_row(key, value, filename) for key, value, filename in items]
+        if not rows:
+            return
         with self.Session() as session:
-            for key, value, filename in items:
-                serialized_value = self.serialize_value(value)
-                hashable_content = self.extract_hashable_content(value)
-                entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=self.compute_hash(hashable_content), filename=filename)
-                session.merge(entry)
+            for stmt in self.upsert_statements(rows, chunk_size):
+                session.execute(stmt)
             session.commit()
+        self.invalidate_cache(row['key'] for row in rows)
 
     def mdelete(self, keys):
         with self.Session() as session:
             session.execute(delete(ByteStore).where(ByteStore.collection_name == self.collection_name, ByteStore.key.in_(keys)))
             session.commit()
+        self.invalidate_cache(keys)
 
-    def yield_keys(self, prefix=None):
-        with self.Session() as session:
-            query = select(ByteStore.key).where(ByteStore.collection_name == self.collection_name)
-            if prefix:
-                query = query.where(ByteStore.key.like(f'{prefix}%'))
-            for row in session.execute(query):
-                yield row.key
+    # Streams keys with a server-side cursor, fetch_size rows at a time. The cursor
+    # gets its own session, not the thread's scoped one, so store calls made while
+    # iterating do not close it.
+    def yield_keys(self, prefix=None, fetch_size=None):
+        query = self.keys_query(prefix).execution_options(yield_per=fetch_size or self.chunk_size)
+        with Session(bind=self.engine) as session:
+            for key in session.scalars(query):
+                yield key
 
     # Asynchronous methods
     async def aget(self, key):
-        async with self.async_session_factory() as session:
-            result = await session.execute(select(ByteStore).filter_by(collection_name=self.collection_name, key=key))
-            byte_store = result.scalars().first()
-            return pickle.loads(byte_store.value) if byte_store else None
+        return (await self.amget([key]))[0]
 
     async def aset(self, key, value, filename):
-        async with self.async_session_factory() as session:
-            serialized_value = self.serialize_value(value)
-            hashable_content = self.extract_hashable_content(value)
-            entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=self.compute_hash(hashable_content), filename=filename)
-            session.merge(entry)
-            await session.commit()
+        await self.amset([(key, value, filename)])
 
     async def amget(self, keys):
-        results = {}
-        async with self.async_session_factory() as session:
-            query_results = await session.execute(select(ByteStore).where(ByteStore.collection_name == self.collection_name, ByteStore.key.in_(keys)))
-            for result in query_results.scalars():
-                results[result.key] = pickle.loads(result.value)
+        results, missing, generation = self.cached_lookup(keys)
+        if missing:
+            fetched = {}
+            async with self.async_session_factory() as session:
+                for result in await session.execute(self.values_query(missing)):
+                    fetched[result.key] = self.deserialize_value(result.value)
+            self.cache_results(fetched, generation)
+            results.update(fetched)
         return [results.get(key) for key in keys]
 
-    async def amset(self, items):
+    async def amset(self, items, chunk_size=None):
+        rows = [self.build_row(key, value, filename) for key, value, filename in items]
+        if not rows:
+            return
         async with self.async_session_factory() as session:
-            for key, value, filename in items:
-                serialized_value = self.serialize_value(value)
-                hashable_content = self.extract_hashable_content(value)
-                entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=self.compute_hash(hashable_content), filename=filename)
-                session.merge(entry)
+            for stmt in self.upsert_statements(rows, chunk_size):
+                await session.execute(stmt)
             await session.commit()
+        self.invalidate_cache(row['key'] for row in rows)
 
     async def amdelete(self, keys):
         async with self.async_session_factory() as session:
             await session.execute(delete(ByteStore).where(ByteStore.collection_name == self.collection_name, ByteStore.key.in_(keys)))
             await session.commit()
+        self.invalidate_cache(keys)
 
-    async def ayield_keys(self, prefix=None):
+    async def ayield_keys(self, prefix=None, fetch_size=None):
+        query = self.keys_query(prefix).execution_options(yield_per=fetch_size or self.chunk_size)
         async with self.async_session_factory() as session:
-            query = select(ByteStore.key).where(ByteStore.collection_name == self.collection_name)
-            if prefix:
-                query = query.where(ByteStore.key.like(f'{prefix}%'))
-            async for row in session.stream(query):
-                yield row.key
+            async for key in await session.stream_scalars(query):
+                yield key
 
     # New synchronous methods with hash checking
     def conditional_set(self, key, value, filename):
-        serialized_value = self.serialize_value(value)
         hashable_content = self.extract_hashable_content(value)
-        new_hash = self.compute_hash(hashable_content)
+        new_digest = self.compute_hash(hashable_content)
         with self.Session() as session:
-            result = session.execute(select(ByteStore).filter_by(collection_name=self.collection_name, key=key, filename=filename)).scalar()
+            result = session.execute(
+                select(ByteStore.value_hash, ByteStore.value_digest).filter_by(collection_name=self.collection_name, key=key, filename=filename)
+            ).first()
             if result:
-                if result.value_hash == new_hash:
+                if self.hash_matches(result.value_digest, result.value_hash, hashable_content, new_digest):
                     return key, 'SKIP'  # No update needed
                 operation = 'UPD'
             else:
                 operation = 'INS'
-            entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-            session.merge(entry)
+            session.execute(self.upsert_statement([self.build_row(key, value, filename, value_digest=new_digest)]))
             session.commit()
-            return key, operation
+        self.invalidate_cache([key])
+        return key, operation
 
+    # Items may belong to many files; each file in the batch is synced as a whole
     def conditional_mset(self, items):
-        modified_keys = []
-        item_keys = {(key, filename) for key, _, filename in items}
+        if not items:
+            return []
         with self.Session() as session:
-            # Process deletions first
-            existing_keys = session.execute(
-                select(ByteStore.key).where(
-                    ByteStore.collection_name == self.collection_name,
-                    ByteStore.filename == items[0][2]
-                )
-            ).scalars().all()
-
-            keys_to_delete = set(existing_keys) - {key for key, _, _ in items}
-            if keys_to_delete:
-                session.execute(
-                    delete(ByteStore).where(
-                        ByteStore.collection_name == self.collection_name,
-                        ByteStore.filename == items[0][2],
-                        ByteStore.key.in_(keys_to_delete)
-                    )
-                )
-                modified_keys.extend([(key, 'DEL') for key in keys_to_delete])
-            session.commit()
-
-            existing_records = session.execute(select(ByteStore).filter_by(collection_name=self.collection_name)).scalars().all()
-            existing_record_map = {(record.key, record.filename): record for record in existing_records}
-
-            # Process inserts and updates
-            for key, value, filename in items:
-                serialized_value = self.serialize_value(value)
-                hashable_content = self.extract_hashable_content(value)
-                new_hash = self.compute_hash(hashable_content)
-                if (key, filename) in existing_record_map:
-                    existing_hash = existing_record_map[(key, filename)].value_hash
-                    if existing_hash == new_hash:
-                        modified_keys.append((key, 'SKIP'))
-                    else:
-                        entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-                        session.merge(entry)
-                        modified_keys.append((key, 'UPD'))
-                else:
-                    entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-                    session.add(entry)
-                    modified_keys.append((key, 'INS'))
-
+            existing_rows = []
+            for query in self.existing_hashes_queries(items):
+                existing_rows.extend(session.execute(query).all())
+            modified_keys, pairs_to_delete, rows_to_write = self.diff_items(items, existing_rows)
+            for stmt in self.delete_statements(pairs_to_delete):
+                session.execute(stmt)
+            for stmt in self.upsert_statements(rows_to_write):
+                session.execute(stmt)
             session.commit()
+        self.invalidate_cache(key for key, operation in modified_keys if operation != 'SKIP')
         return modified_keys
 
     # New asynchronous methods with hash checking
     async def aconditional_set(self, key, value, filename):
-        serialized_value = self.serialize_value(value)
         hashable_content = self.extract_hashable_content(value)
-        new_hash = self.compute_hash(hashable_content)
+        new_digest = self.compute_hash(hashable_content)
         async with self.async_session_factory() as session:
-            result = await session.execute(select(ByteStore).filter_by(collection_name=self.collection_name, key=key, filename=filename))
-            result = result.scalars().first()
+            result = (await session.execute(
+                select(ByteStore.value_hash, ByteStore.value_digest).filter_by(collection_name=self.collection_name, key=key, filename=filename)
+            )).first()
             if result:
-                if result.value_hash == new_hash:
+                if self.hash_matches(result.value_digest, result.value_hash, hashable_content, new_digest):
                     return key, 'SKIP'  # No update needed
                 operation = 'UPD'
             else:
                 operation = 'INS'
-            entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-            session.merge(entry)
+            await session.execute(self.upsert_statement([self.build_row(key, value, filename, value_digest=new_digest)]))
             await session.commit()
-            return key, operation
+        self.invalidate_cache([key])
+        return key, operation
 
     async def aconditional_mset(self, items):
-        modified_keys = []
-        item_keys = {(key, filename) for key, _, filename in items}
+        if not items:
+            return []
         async with self.async_session_factory() as session:
-            # Process deletions first
-            existing_keys = (await session.execute(
-                select(ByteStore.key).where(
-                    ByteStore.collection_name == self.collection_name,
-                    ByteStore.filename == items[0][2]
-                )
-            )).scalars().all()
-
-            keys_to_delete = set(existing_keys) - {key for key, _, _ in items}
-            if keys_to_delete:
-                await session.execute(
-                    delete(ByteStore).where(
-                        ByteStore.collection_name == self.collection_name,
-                        ByteStore.filename == items[0][2],
-                        ByteStore.key.in_(keys_to_delete)
-                    )
-                )
-                modified_keys.extend([(key, 'DEL') for key in keys_to_delete])
-            await session.commit()
-
-            existing_records = (await session.execute(select(ByteStore).filter_by(collection_name=self.collection_name))).scalars().all()
-            existing_record_map = {(record.key, record.filename): record for record in existing_records}
-
-            # Process inserts and updates
-            for key, value, filename in items:
-                serialized_value = self.serialize_value(value)
-                hashable_content = self.extract_hashable_content(value)
-                new_hash = self.compute_hash(hashable_content)
-                if (key, filename) in existing_record_map:
-                    existing_hash = existing_record_map[(key, filename)].value_hash
-                    if existing_hash == new_hash:
-                        modified_keys.append((key, 'SKIP'))
-                    else:
-                        entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-                        session.merge(entry)
-                        modified_keys.append((key, 'UPD'))
-                else:
-                    entry = ByteStore(collection_name=self.collection_name, key=key, value=serialized_value, value_hash=new_hash, filename=filename)
-                    session.add(entry)
-                    modified_keys.append((key, 'INS'))
-
+            existing_rows = []
+            for query in self.existing_hashes_queries(items):
+                existing_rows.extend((await session.execute(query)).all())
+            modified_keys, pairs_to_delete, rows_to_write = self.diff_items(items, existing_rows)
+            for stmt in self.delete_statements(pairs_to_delete):
+                await session.execute(stmt)
+            for stmt in self.upsert_statements(rows_to_write):
+                await session.execute(stmt)
             await session.commit()
+        self.invalidate_cache(key for key, operation in modified_keys if operation != 'SKIP')
         return modified_keys
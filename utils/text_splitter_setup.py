@@ -1,79 +1,155 @@
-from sqlalchemy import create_engine, Column, String, LargeBinary, select, Table, MetaData
+from sqlalchemy import Column, String, LargeBinary, Index, select, Table, MetaData, any_, bindparam
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from langchain.schema.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils import _batch
+from utils.engines import get_engine
+from utils.parallel import ordered_chunk_map
 
-def setup_text_splitter_and_process_documents(CONNECTION_STRING, parent_docs_operations, retriever):
-    separators = ["\n\n", "\n", ".", "?", "!"]
+# Columns of the PGVector embedding table read here
+langchain_pg_embedding = Table(
+    'langchain_pg_embedding', MetaData(),
+    Column('id', String, primary_key=True),
+    Column('collection_id', String),
+    Column('embedding', LargeBinary),
+    Column('document', String),
+    Column('cmetadata', JSONB)
+)
 
+# Serves the lookups of child chunks by parent doc_id and type
+child_chunk_index = Index(
+    'ix_langchain_pg_embedding_doc_id_type',
+    langchain_pg_embedding.c.cmetadata['doc_id'].astext,
+    langchain_pg_embedding.c.cmetadata['type'].astext,
+)
+
+def create_child_chunk_index(engine):
+    """Create the expression index on cmetadata->>'doc_id' and cmetadata->>'type' if it is missing."""
+    child_chunk_index.create(engine, checkfirst=True)
+
+def fetch_child_chunks(session, doc_ids, chunk_size=1000):
+    """Return the 'smaller chunk' sub-documents of each doc_id, ordered by id.
+
+    One query per chunk_size doc_ids, selecting only document and cmetadata.
+    """
+    doc_id_column = langchain_pg_embedding.c.cmetadata['doc_id'].astext
+    children = {doc_id: [] for doc_id in doc_ids}
+    for chunk in _batch(chunk_size, doc_ids):
+        query = select(
+            langchain_pg_embedding.c.document,
+            langchain_pg_embedding.c.cmetadata
+        ).where(
+            (doc_id_column == any_(bindparam('doc_ids', chunk, type_=ARRAY(String)))) &
+            (langchain_pg_embedding.c.cmetadata['type'].astext == 'smaller chunk')
+        ).order_by(doc_id_column, langchain_pg_embedding.c.id)  # Ensure fixed order
+        for row in session.execute(query):
+            children[row.cmetadata['doc_id']].append(Document(page_content=row.document, metadata=row.cmetadata))
+    return children
+
+# Parameters of the RecursiveCharacterTextSplitter used for child chunks
+CHILD_SPLITTER_KWARGS = {
+    "chunk_size": 400,
+    "chunk_overlap": 20,
+    "separators": ["\n\n", "\n", ".", "?", "!"],
+}
+
+def split_parent_documents(parents):
+    """Split (doc_id, document) pairs into child chunks, one sorted list per parent.
+
+    Runs in the worker processes of setup_text_splitter_and_process_documents,
+    so it builds its own splitter.
+    """
     # Initialize the RecursiveCharacterTextSplitter with fixed parameters
-    child_text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=20,
-        separators=separators
+    child_text_splitter = RecursiveCharacterTextSplitter(**CHILD_SPLITTER_KWARGS)
+    results = []
+    for doc_id, doc in parents:
+        source = doc.metadata.get("source")  # Retrieve the source from the document's metadata
+        sub_docs = child_text_splitter.split_documents([doc])
+        # Ensure fixed order for sub-documents
+        sub_docs = sorted(sub_docs, key=lambda x: x.page_content)
+        for sub_doc in sub_docs:
+            sub_doc.metadata["doc_id"] = doc_id  # Assign the same doc_id to each sub-document
+            sub_doc.metadata["source"] = f"{source}(smaller chunk)"  # Add the suffix to the source
+            sub_doc.metadata["type"] = "smaller chunk"
+        results.append(sub_docs)
+    return results
+
+def fetch_parent_documents(docstore, doc_ids, chunk_size=1000):
+    """Yield lists of (doc_id, document) pairs, reading chunk_size keys per mget.
+
+    Keys missing from the docstore are left out.
+    """
+    for chunk in _batch(chunk_size, doc_ids):
+        yield [(doc_id, doc) for doc_id, doc in zip(chunk, docstore.mget(chunk)) if doc]
+
+def split_parents(docstore, doc_ids, fetch_chunk_size=1000, split_workers=None, split_chunk_size=20):
+    """Return the child chunks of each doc_id found in the docstore.
+
+    With split_workers > 1 the parents are split on a process pool,
+    split_chunk_size parents per task (see utils.parallel), while the next
+    chunks are read from the docstore. The result does not depend on it.
+    """
+    children = {}
+    parent_chunks = (
+        parent_chunk
+        for fetched in fetch_parent_documents(docstore, doc_ids, chunk_size=fetch_chunk_size)
+        for parent_chunk in _batch(split_chunk_size, fetched)
     )
+    if split_workers and split_workers > 1:
+        split_chunks = ordered_chunk_map(split_parent_documents, parent_chunks, max_workers=split_workers)
+    else:
+        split_chunks = ((parent_chunk, split_parent_documents(parent_chunk)) for parent_chunk in parent_chunks)
+    for parent_chunk, sub_doc_lists in split_chunks:
+        for (doc_id, _), sub_docs in zip(parent_chunk, sub_doc_lists):
+            children[doc_id] = sub_docs
+    return children
 
+def setup_text_splitter_and_process_documents(CONNECTION_STRING, parent_docs_operations, retriever, fetch_chunk_size=1000, create_indexes=False, split_workers=None, split_chunk_size=20):
+    """Return the child chunks of the parents, in sorted doc_id order.
+
+    SKIP parents reuse their stored chunks; the others are read from the
+    docstore and split again. The unchanged children of an UPD parent keep
+    their text and source, hence their uid, so index_with_ids reports them
+    as SKIP without embedding them again; only new or edited chunks are
+    embedded.
+    """
     # List to store all sub-documents
     all_sub_docs = []
 
-    # Database connection setup
-    engine = create_engine(CONNECTION_STRING)
+    # Database connection setup, reusing the process-wide engine
+    engine = get_engine(CONNECTION_STRING)
+    if create_indexes:
+        create_child_chunk_index(engine)
     Session = sessionmaker(bind=engine)
-    session = Session()
-
-    # Define table structure
-    metadata = MetaData()
-    langchain_pg_embedding = Table(
-        'langchain_pg_embedding', metadata,
-        Column('id', String, primary_key=True),
-        Column('collection_id', String),
-        Column('embedding', LargeBinary),
-        Column('document', String),
-        Column('cmetadata', JSONB)
-    )
 
     # Sort the parent documents operations to ensure deterministic processing order
     parent_docs_operations = sorted(parent_docs_operations, key=lambda x: x[0])
 
+    # Fetch the stored sub-documents of every SKIP document, fetch_chunk_size doc_ids per query
+    with Session() as session:
+        skipped_children = fetch_child_chunks(
+            session,
+            [doc_id for doc_id, operation in parent_docs_operations if operation == 'SKIP'],
+            chunk_size=fetch_chunk_size,
+        )
+
+    # Read the other documents from the docstore in chunks and split them, in parallel with split_workers
+    split_children = split_parents(
+        retriever.docstore,
+        list(dict.fromkeys(doc_id for doc_id, operation in parent_docs_operations if operation != 'SKIP')),
+        fetch_chunk_size=fetch_chunk_size,
+        split_workers=split_workers,
+        split_chunk_size=split_chunk_size,
+    )
+
     # Iterate through the operations
     for doc_id, operation in parent_docs_operations:
         if operation == 'SKIP':
-            # Fetch records from langchain_pg_embedding table for SKIP documents
-            query = select(
-                langchain_pg_embedding.c.id,
-                langchain_pg_embedding.c.collection_id,
-                langchain_pg_embedding.c.embedding,
-                langchain_pg_embedding.c.document,
-                langchain_pg_embedding.c.cmetadata
-            ).where(
-                (langchain_pg_embedding.c.cmetadata['doc_id'].astext == doc_id) &
-                (langchain_pg_embedding.c.cmetadata['type'].astext == 'smaller chunk')
-            ).order_by(langchain_pg_embedding.c.id)  # Ensure fixed order
-            
-            result = session.execute(query).fetchall()
-            
-            # Recreate sub-documents from fetched records
-            for row in result:
-                metadata = row.cmetadata
-                sub_doc_content = row.document
-                sub_doc = Document(page_content=sub_doc_content, metadata=metadata)
-                all_sub_docs.append(sub_doc)
+            # Reuse the sub-documents already stored for SKIP documents
+            all_sub_docs.extend(skipped_children[doc_id])
         else:
-            # Retrieve the document from the docstore for non-SKIP documents
-            doc = retriever.docstore.get(doc_id)
-            if doc:
-                source = doc.metadata.get("source")  # Retrieve the source from the document's metadata
-                sub_docs = child_text_splitter.split_documents([doc])
-                # Ensure fixed order for sub-documents
-                sub_docs = sorted(sub_docs, key=lambda x: x.page_content)
-                for sub_doc in sub_docs:
-                    sub_doc.metadata["doc_id"] = doc_id  # Assign the same doc_id to each sub-document
-                    sub_doc.metadata["source"] = f"{source}(smaller chunk)"  # Add the suffix to the source
-                    sub_doc.metadata["type"] = "smaller chunk"
-                all_sub_docs.extend(sub_docs)
-
-    # Close the session after use
-    session.close()
+            # Documents missing from the docstore have no sub-documents
+            all_sub_docs.extend(split_children.get(doc_id, []))
 
     return all_sub_docs
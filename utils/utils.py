@@ -2,22 +2,28 @@ import hashlib
 import json
 import uuid
 import logging
-from typing import Any, Dict, Optional, Union, Iterable, Iterator, Sequence, Set, Callable, List, TypeVar, cast
+from typing import Any, Dict, Optional, Tuple, Union, Iterable, Iterator, Sequence, Set, Callable, List, TypeVar, cast
 from itertools import islice
 from langchain_core.documents import Document
 from langchain_core.pydantic_v1 import root_validator
+from utils.hashing import DEFAULT_ALGORITHM, LEGACY_ALGORITHM, get_hasher
 
 T = TypeVar("T")
 
 NAMESPACE_UUID = uuid.UUID(int=1984)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, filename='hashed_document_debug.log')
+logger = logging.getLogger(__name__)
 
-def _hash_string_to_uuid(input_string: str) -> uuid.UUID:
-    """Hashes a string and returns the corresponding UUID."""
-    hash_value = hashlib.sha1(input_string.encode("utf-8")).hexdigest()
-    return uuid.uuid5(NAMESPACE_UUID, hash_value)
+def _hash_string_to_uuid(input_string: str, algorithm: str = DEFAULT_ALGORITHM) -> uuid.UUID:
+    """Hashes a string and returns the corresponding UUID.
+
+    The legacy sha1 algorithm derives a uuid5 from the hex digest, which keeps
+    existing ids stable. Other algorithms use the first 16 digest bytes directly.
+    """
+    if algorithm == LEGACY_ALGORITHM:
+        hash_value = hashlib.sha1(input_string.encode("utf-8")).hexdigest()
+        return uuid.uuid5(NAMESPACE_UUID, hash_value)
+    return uuid.UUID(bytes=get_hasher(algorithm)(input_string.encode("utf-8"))[:16])
 
 def _hash_nested_dict_to_uuid(data: Dict[Any, Any]) -> uuid.UUID:
     """Hashes a nested dictionary and returns the corresponding UUID."""
@@ -65,29 +71,31 @@ class _HashedDocument(Document):
         """Root validator to calculate content and metadata hash."""
         content = values.get("page_content", "")
         metadata = values.get("metadata", {})
+        algorithm = values.pop("hash_algorithm", None) or DEFAULT_ALGORITHM
 
         # Only include the source field in the metadata hash
         source = metadata.get("source", "")
 
-        content_hash = str(_hash_string_to_uuid(content))
-        source_hash = str(_hash_string_to_uuid(source))
+        content_hash = str(_hash_string_to_uuid(content, algorithm))
+        source_hash = str(_hash_string_to_uuid(source, algorithm))
 
         values["content_hash"] = content_hash
         values["source_hash"] = source_hash
-        values["hash_"] = str(_hash_string_to_uuid(content_hash + source_hash))
+        values["hash_"] = str(_hash_string_to_uuid(content_hash + source_hash, algorithm))
 
         _uid = values.get("uid", None)
 
         if _uid is None:
             values["uid"] = values["hash_"]
 
-        # Logging to verify determinism
-        logging.debug(f"Document Content: {content}")
-        logging.debug(f"Document Metadata: {metadata}")
-        logging.debug(f"Content Hash: {content_hash}")
-        logging.debug(f"Source Hash: {source_hash}")
-        logging.debug(f"Combined Hash (hash_): {values['hash_']}")
-        logging.debug(f"UID: {values['uid']}")
+        # Logging to verify determinism; enable DEBUG for the utils.utils logger to see it
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Document Content: {content}")
+            logger.debug(f"Document Metadata: {metadata}")
+            logger.debug(f"Content Hash: {content_hash}")
+            logger.debug(f"Source Hash: {source_hash}")
+            logger.debug(f"Combined Hash (hash_): {values['hash_']}")
+            logger.debug(f"UID: {values['uid']}")
 
         return values
 
@@ -100,15 +108,107 @@ class _HashedDocument(Document):
 
     @classmethod
     def from_document(
-        cls, document: Document, *, uid: Optional[str] = None
+        cls, document: Document, *, uid: Optional[str] = None, hash_algorithm: Optional[str] = None
     ) -> '_HashedDocument':
-        """Create a HashedDocument from a Document."""
+        """Create a HashedDocument from a Document.
+
+        hash_algorithm selects one of the algorithms of utils.hashing. The
+        default (sha1) produces the same uids as earlier versions; changing it
+        on an existing index makes every document look new.
+        """
         return cls(
             uid=uid,
             page_content=document.page_content,
             metadata=document.metadata,
+            hash_algorithm=hash_algorithm,
         )
 
+
+# (hash_, content_hash, source_hash) of a document; hash_ is also the default uid
+HashTriple = Tuple[str, str, str]
+
+def _hash_document_strings(content: str, source: str, algorithm: str) -> HashTriple:
+    """Compute the hashes of _HashedDocument from the page content and source."""
+    content_hash = str(_hash_string_to_uuid(content, algorithm))
+    source_hash = str(_hash_string_to_uuid(source, algorithm))
+    return str(_hash_string_to_uuid(content_hash + source_hash, algorithm)), content_hash, source_hash
+
+
+class _HashedRecord:
+    """A hashed document without pydantic validation, used by index_with_ids.
+
+    Hashes and uid are the same as _HashedDocument's for the same algorithm.
+    They are computed together on first access and kept, or given up front
+    by from_hashes (see utils.parallel). The wrapped document is returned as
+    is by to_document, so indexing a document allocates a single small object.
+    """
+
+    __slots__ = ("document", "hash_algorithm", "_uid", "_hashes")
+
+    def __init__(
+        self,
+        document: Document,
+        uid: Optional[str] = None,
+        hash_algorithm: Optional[str] = None,
+        hashes: Optional[HashTriple] = None,
+    ) -> None:
+        self.document = document
+        self.hash_algorithm = hash_algorithm or DEFAULT_ALGORITHM
+        self._uid = uid
+        self._hashes = hashes
+
+    def _get_hashes(self) -> HashTriple:
+        if self._hashes is None:
+            # Only include the source field in the metadata hash
+            source = self.document.metadata.get("source", "")
+            self._hashes = _hash_document_strings(self.document.page_content, source, self.hash_algorithm)
+        return self._hashes
+
+    @property
+    def page_content(self) -> str:
+        return self.document.page_content
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.document.metadata
+
+    @property
+    def hash_(self) -> str:
+        return self._get_hashes()[0]
+
+    @property
+    def content_hash(self) -> str:
+        return self._get_hashes()[1]
+
+    @property
+    def source_hash(self) -> str:
+        return self._get_hashes()[2]
+
+    @property
+    def uid(self) -> str:
+        return self._uid if self._uid is not None else self.hash_
+
+    def to_document(self) -> Document:
+        """Return the wrapped Document."""
+        return self.document
+
+    @classmethod
+    def from_document(
+        cls, document: Document, *, uid: Optional[str] = None, hash_algorithm: Optional[str] = None
+    ) -> '_HashedRecord':
+        """Create a _HashedRecord from a Document."""
+        return cls(document, uid=uid, hash_algorithm=hash_algorithm)
+
+    @classmethod
+    def from_hashes(
+        cls, document: Document, hashes: HashTriple, *, hash_algorithm: Optional[str] = None
+    ) -> '_HashedRecord':
+        """Create a _HashedRecord from hashes computed elsewhere with hash_algorithm."""
+        return cls(document, hash_algorithm=hash_algorithm, hashes=hashes)
+
+# Either hashed document type; both expose uid, hash_, content_hash and source_hash
+H = TypeVar("H", _HashedDocument, _HashedRecord)
+
 def _batch(size: int, iterable: Iterable[T]) -> Iterator[List[T]]:
     """Utility batching function."""
     it = iter(iterable)
@@ -119,8 +219,8 @@ def _batch(size: int, iterable: Iterable[T]) -> Iterator[List[T]]:
         yield chunk
 
 def _deduplicate_in_order(
-    hashed_documents: Iterable[_HashedDocument],
-) -> Iterator[_HashedDocument]:
+    hashed_documents: Iterable[H],
+) -> Iterator[H]:
     """Deduplicate a list of hashed documents while preserving order."""
     seen: Set[str] = set()
     for hashed_doc in hashed_documents: